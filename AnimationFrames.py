@@ -1,7 +1,16 @@
 from includes import *
 from config import log
-from itertools import chain, cycle
-from math import sin, pi
+from FrameBuffer import blend_color_arrays, random_color_range_array, random_colors_with_range_from_list, \
+    random_generator
+from FrameCache import frame_cache
+from FrameFile import FrameFile
+from itertools import chain
+from math import sin, pi, isfinite
+import numpy as np
+import time
+
+# Every color of the 'wheel' rainbow, so frames can look colors up instead of computing them
+WHEEL_LUT = np.array([wheel(pos) for pos in range(256)], dtype=np.uint32)
 
 
 class RainbowFrame:
@@ -13,12 +22,22 @@ class RainbowFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
         self._j = 0
 
         speed = config.get('loop_speed', 3)
         self._delay = remap(1, 6, 40, 1, speed)  # measured in 10ms steps (from 1 to 40)
 
+        # The rainbow repeats after going once around the wheel, so render all 256 steps up front
+        cache_key = ('rainbow', self._pixels_count)
+        self._frames = frame_cache.period(cache_key, self._render_period)
+
+    def _render_period(self):
+        # Where each pixel sits on the wheel before it is rotated, then one row per rotation step
+        wheel_offsets = np.arange(self._pixels_count) * 256 // self._pixels_count
+        return WHEEL_LUT[(wheel_offsets[np.newaxis, :] + np.arange(256)[:, np.newaxis]) & 255]
+
     @property
     def delay_between_frames(self):
         # number of 10ms increments to delay before next animation frame should be called
@@ -37,10 +56,7 @@ class RainbowFrame:
         self._j += 1
         self._j %= 256
 
-        for i in range(self._pixels_count):
-            pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-            color = wheel((int(i * 256 / self._pixels_count) + self._j) & 255)
-            self._strip.setPixelColor(pixel_to_set, color)
+        self._strip.write(self._index, self._frames[self._j])
 
 
 class WarpFrame:
@@ -54,6 +70,7 @@ class WarpFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
 
         self._speed = speed = config.get('loop_speed', 3)
@@ -63,10 +80,27 @@ class WarpFrame:
         self._provided_colors = config.get('color_list', [])
         self._starting_color = self._provided_colors[0] if len(self._provided_colors) > 0 else Color(0, 0, 255)
         self._ending_color = self._provided_colors[1] if len(self._provided_colors) > 1 else Color(255, 255, 255)
-        self._pulse_height = config.get('pulse_height', 50)
+        self._pulse_height = int(config.get('pulse_height', 50))
+        self._step = 0
+
+        # One period is the height cycling from 0..50..1, so render every step of it up front
+        cache_key = ('warp', int(self._starting_color), int(self._ending_color), self._pulse_height,
+                     self._pixels_count)
+        self._frames = frame_cache.period(cache_key, self._render_period)
+
+    def _render_period(self):
+        # Build the set of numbers that cycles from 0..50..1, one row of pixels for each
+        heights = np.array(list(chain(range(0, self._pulse_height), range(self._pulse_height, 0, -1))))
+        y_range = heights / self._pulse_height
+
+        # Note on math: .5*pi = 1, 1.5*pi = -1.  So sin(x + .5pi) + 1 ranges from 0to2 and 0to2pi
+        # .5*(sin((2*pi*x) - (.5*pi))+1) goes from 0to1 and 0to1
+        # Set it so the first is always a little into the color mix
+        x_range = (np.arange(self._pixels_count) + .5) / (self._pixels_count + 1)
+        amplitudes = .5 * (np.sin((2 * pi * x_range) - (.5 * pi)) + 1)
 
-        # Build an iterable set of numbers that cycles from 1..50..1..50..1, etc
-        self._height_matrix = cycle(chain(range(0, self._pulse_height), range(self._pulse_height, 0, -1)))
+        return blend_color_arrays(self._starting_color, self._ending_color,
+                                  amplitudes[np.newaxis, :] * y_range[:, np.newaxis])
 
     @property
     def delay_between_frames(self):
@@ -82,20 +116,9 @@ class WarpFrame:
         return self._strip_id
 
     def next(self):
-        # Loop through each pixel and blend it toward the target color
-        height_of_pulse = self._height_matrix.__next__()  # Move the height closer or farther in its cycle
-
-        for i in range(self._pixel_ids):
-            pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-
-            # Note on math: .5*pi = 1, 1.5*pi = -1.  So sin(x + .5pi) + 1 ranges from 0to2 and 0to2pi
-            # .5*(sin((2*pi*x) - (.5*pi))+1) goes from 0to1 and 0to1
-            x_range = (i + .5) / (self._pixels_count + 1)  # Set it so the first is always a little into the color mix
-            amplitude_of_point = .5 * (sin((2 * pi * x_range) - (.5 * pi)) + 1)
-            y_range = height_of_pulse / self._pulse_height
-
-            color = blend_colors(self._starting_color, self._ending_color, amplitude_of_point * y_range)
-            self._strip.setPixelColor(pixel_to_set, color)
+        # Every pixel is blended toward the target color by its place on the sine wave and the current height
+        self._strip.write(self._index, self._frames[self._step])
+        self._step = (self._step + 1) % len(self._frames)  # Move the height closer or farther in its cycle
 
 
 class TwinkleFrame:
@@ -106,6 +129,7 @@ class TwinkleFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
 
         self._speed = speed = config.get('loop_speed', 3)
@@ -125,19 +149,16 @@ class TwinkleFrame:
         self._chance_to_start_a_twinkle = float(config.get('density', .3))
         self._speed_to_blend = .05
         self._twinkle_variance = .2
+        self._random = random_generator(config.get('seed'))
 
-        # Have a list for each pixel to show what percentage it's animated and color
-        self._led_status_list = []
-        self._led_color_list = []
-        for i in range(pixel_ids):
-            self._led_status_list.append(0)
+        # Have an array entry for each pixel to show what percentage it's animated and its target color
+        self._led_status = np.zeros(self._pixels_count, dtype=np.float64)
 
-            # set all pixels to a random appropriate starting color
-            starting_color = random_color_with_range_from_list(self._provided_colors, self._color_variations,
-                                                               self._twinkle_variance)
-            self._led_color_list.append(starting_color)
-            pixel_to_set = pixel_ids[i] if pixel_ids else i
-            strip.setPixelColor(pixel_to_set, starting_color)
+        # set all pixels to a random appropriate starting color
+        self._led_colors = random_colors_with_range_from_list(self._provided_colors, self._color_variations,
+                                                              self._twinkle_variance, self._pixels_count,
+                                                              self._random)
+        strip.write(self._index, self._led_colors)
 
     @property
     def delay_between_frames(self):
@@ -153,55 +174,50 @@ class TwinkleFrame:
         return self._strip_id
 
     def next(self):
-        # Loop through each pixel and randomly blend it towards a target color
-        for i in range(self._pixels_count):
-            current_color = "unset"
-            current_color_target = "unset"
-            try:
-                pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-                current_color = self._strip.getPixelColorRGB(pixel_to_set)
-                current_color_target = self._led_color_list[i]
-                current_animation_amount = self._led_status_list[i]
-
-                # Use a state machine (tracked by current_animation_amount) for how each pixel is animating
-                if current_animation_amount >= self._max_animation_amount:  # It passed the goal, start de-animating it
-                    # Make it negative to show that it should decrease
-                    self._led_status_list[i] *= -1
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                elif (2 + self._speed / 2) < current_animation_amount < self._max_animation_amount:
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                    # Usually increase the brightness towards the target, but sometimes don't
-                    if random.random() < self._chance_to_increase_brightness:
-                        self._led_status_list[i] /= 2
-                    else:
-                        self._led_status_list[i] += random.random()
-
-                    if random.random() < self._chance_to_change_colors:
-                        self._led_color_list[i] = random_color_with_range_from_list(self._provided_colors,
-                                                                                    self._color_variations,
-                                                                                    self._twinkle_variance)
-
-                elif 0 < current_animation_amount:  # It started animating, don't mess with it
-                    self._led_status_list[i] += random.random()
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                elif current_animation_amount == 0:  # It is not animating
-                    # Set it towards the target
-                    if random.random() < (self._chance_to_start_a_twinkle**2):
-                        self._led_status_list[i] += random.random()
-                        new_color = random_color_range(current_color, self._twinkle_variance)
-                        self._led_color_list[i] = new_color
-                        current_color = Color(255, 255, 255)
-                elif current_animation_amount > (-1 - self._speed / 2):  # It's close enough to 0, end the animation
-                    self._led_status_list[i] = 0
-                    current_color = current_color_target
-                else:  # It's negative, so should approach back to 0
-                    self._led_status_list[i] += random.random()
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-
-                self._strip.setPixelColor(pixel_to_set, current_color)
-
-            except AttributeError as e:
-                log.warn("Color error: current:{} target:{}. {}".format(current_color, current_color_target, e))
+        # Randomly blend every pixel towards its target color, using a state machine (tracked by the
+        # status value of each pixel) to pick how each pixel is animating
+        status = self._led_status
+        current_colors = self._strip.read(self._index)
+        rolls = self._random.random((3, self._pixels_count))
+
+        passed_goal = status >= self._max_animation_amount  # It passed the goal, start de-animating it
+        toward_target = ((2 + self._speed / 2) < status) & (status < self._max_animation_amount)
+        started = (0 < status) & ~passed_goal & ~toward_target  # It started animating, don't mess with it
+        not_animating = status == 0
+        ending = (status < 0) & (status > (-1 - self._speed / 2))  # It's close enough to 0, end the animation
+        returning = status <= (-1 - self._speed / 2)  # It's negative, so should approach back to 0
+
+        blending = passed_goal | toward_target | started | returning
+        new_colors = np.where(blending, blend_color_arrays(current_colors, self._led_colors, self._speed_to_blend),
+                              current_colors)
+        new_colors[ending] = self._led_colors[ending]
+
+        # Make it negative to show that it should decrease
+        status[passed_goal] *= -1
+
+        # Usually increase the brightness towards the target, but sometimes don't
+        dimming = toward_target & (rolls[0] < self._chance_to_increase_brightness)
+        status[dimming] /= 2
+        brightening = (toward_target & ~dimming) | started | returning
+        status[brightening] += rolls[1][brightening]
+
+        changing_color = toward_target & (rolls[2] < self._chance_to_change_colors)
+        if changing_color.any():
+            self._led_colors[changing_color] = random_colors_with_range_from_list(
+                self._provided_colors, self._color_variations, self._twinkle_variance, int(changing_color.sum()),
+                self._random)
+
+        # Start some new twinkles, flashing to white before heading to a color near the current one
+        starting = not_animating & (rolls[0] < (self._chance_to_start_a_twinkle**2))
+        if starting.any():
+            status[starting] += rolls[1][starting]
+            self._led_colors[starting] = random_color_range_array(current_colors[starting], self._twinkle_variance,
+                                                                   self._random)
+            new_colors[starting] = Color(255, 255, 255)
+
+        status[ending] = 0
+
+        self._strip.write(self._index, new_colors)
 
 
 class PulseFrame:
@@ -215,6 +231,7 @@ class PulseFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
 
         self._speed = speed = config.get('loop_speed', 3)
@@ -226,12 +243,17 @@ class PulseFrame:
         self._ending_color = self._provided_colors[1] if len(self._provided_colors) > 1 else Color(255, 255, 255)
 
         self._color_variations = config.get('color_variations', [])
-        self._pulse_height = config.get('pulse_height', 50)
+        self._pulse_height = int(config.get('pulse_height', 50))
+        if self._pulse_height < 1:
+            raise ValueError("pulse_height must be at least 1, not {}".format(self._pulse_height))
         self._mode = config.get('mode', 'linear')
-        self._iteration = 0
+        self._step = 0
 
-        # Build an iterable set of numbers that cycles from 1..50..1..50..1, etc
-        self._height_matrix = cycle(chain(range(0, self._pulse_height), range(self._pulse_height, 0, -1)))
+        # One period is a height cycle from 0..50..1 for each ending color, so render all of it up front
+        cache_key = ('pulsing', int(self._starting_color), int(self._ending_color),
+                     tuple(int(color) for color in self._provided_colors), self._pulse_height, self._mode,
+                     self._pixels_count)
+        self._frames = frame_cache.period(cache_key, self._render_period)
 
     @property
     def delay_between_frames(self):
@@ -246,15 +268,7 @@ class PulseFrame:
     def strip_id(self):
         return self._strip_id
 
-    def next(self):
-        # Loop through each pixel and blend it toward the target color
-        height_of_pulse = self._height_matrix.__next__()  # Move the height closer or farther in its cycle
-        if height_of_pulse == 0:  # If the loop started over
-            # Move to next ending color (CLEANUP: Can make this an iterable cycle for legibility)
-            if len(self._provided_colors) > 1:
-                self._ending_color = self._provided_colors[(self._iteration + 1) % len(self._provided_colors)]
-            self._iteration += 1
-
+    def _pulse_height_for(self, height_of_pulse):
         # Determine 'height' or how bright the pulse is, depending on the blending mode
         height = height_of_pulse / self._pulse_height
         if self._mode == 'sin':
@@ -269,14 +283,27 @@ class PulseFrame:
                 height = 0
         elif self._mode == 'linear':
             pass  # use base height
+        return height
+
+    def _render_period(self):
+        # Build the set of numbers that cycles from 0..50..1, and each time the loop starts over
+        # move to the next ending color
+        heights = list(chain(range(0, self._pulse_height), range(self._pulse_height, 0, -1)))
+        color_count = len(self._provided_colors) if len(self._provided_colors) > 1 else 1
 
-        # Determine the color
-        color = blend_colors(self._starting_color, self._ending_color, height)
+        frames = []
+        for iteration in range(color_count):
+            ending_color = self._ending_color
+            if len(self._provided_colors) > 1:
+                ending_color = self._provided_colors[(iteration + 1) % len(self._provided_colors)]
+            for height_of_pulse in heights:
+                frames.append(blend_colors(self._starting_color, ending_color, self._pulse_height_for(height_of_pulse)))
+        return np.array(frames, dtype=np.uint32)
 
-        # Set all pixels to that color
-        for i in range(self._pixels_count):
-            pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-            self._strip.setPixelColor(pixel_to_set, color)
+    def next(self):
+        # Set all pixels to the color for this step of the pulse
+        self._strip.write(self._index, self._frames[self._step])
+        self._step = (self._step + 1) % len(self._frames)
 
 
 class BlinkFrame:
@@ -289,6 +316,7 @@ class BlinkFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
 
         self._speed = speed = config.get('loop_speed', 3)
@@ -302,6 +330,9 @@ class BlinkFrame:
         if len(self._provided_colors) < 2:
             self._provided_colors.append(Color(0, 0, 0))
 
+        cache_key = ('blinking', tuple(int(color) for color in self._provided_colors))
+        self._frames = frame_cache.period(cache_key, lambda: np.array(self._provided_colors, dtype=np.uint32))
+
     @property
     def delay_between_frames(self):
         # number of 10ms increments to delay before next animation frame should be called
@@ -317,12 +348,7 @@ class BlinkFrame:
 
     def next(self):
         # Set all pixels to next color in sequence
-        color = self._provided_colors[self._iteration % len(self._provided_colors)]
-
-        # Set all pixels to that color
-        for i in range(self._pixels_count):
-            pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-            self._strip.setPixelColor(pixel_to_set, color)
+        self._strip.write(self._index, self._frames[self._iteration % len(self._frames)])
 
         self._iteration += 1
 
@@ -337,6 +363,7 @@ class BlinkenlichtFrame:
         self._strip = strip
         self._strip_id = strip_id
         self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
         self._config = config if config else {}
 
         self._speed = speed = config.get('loop_speed', 3)
@@ -358,17 +385,14 @@ class BlinkenlichtFrame:
         self._speed_to_blend = 2 / self._max_animation_amount
         self._iteration = 0
         self._mode = config.get('mode', 'linear')
+        self._random = random_generator(config.get('seed'))
 
-        # Have a list for each pixel to show what percentage it's animated and color
-        self._led_status_list = []
-        self._led_color_list = []
+        # Have an array entry for each pixel to show what percentage it's animated and its target color
+        self._led_status = np.zeros(self._pixels_count, dtype=np.float64)
+        self._led_colors = np.full(self._pixels_count, self._starting_color, dtype=np.uint32)
 
         # set all pixels to starting color
-        for i in range(pixel_ids):
-            self._led_status_list.append(0)
-            self._led_color_list.append(self._starting_color)
-            pixel_to_set = pixel_ids[i] if pixel_ids else i
-            strip.setPixelColor(pixel_to_set, self._starting_color)
+        strip.write(self._index, self._starting_color)
 
     @property
     def delay_between_frames(self):
@@ -384,69 +408,147 @@ class BlinkenlichtFrame:
         return self._strip_id
 
     def next(self):
-        # Loop through each pixel and randomly blend it towards a target color
-
-        # Loop through each pixel and randomly blend it towards a target color
-        current_color = "unset"
-        new_color = random_color_with_range_from_list(self._provided_colors, self._color_variations, .2)
-
-        for i in range(self._pixels_count):
-            try:
-                pixel_to_set = self._pixel_ids[i] if self._pixel_ids else i
-                current_color = self._strip.getPixelColorRGB(pixel_to_set)
-                current_color_target = self._led_color_list[i]
-                current_animation_amount = self._led_status_list[i]
-
-                # Use a state machine (tracked by current_animation_amount) for how each pixel is animating
-                if current_animation_amount >= self._max_animation_amount:  # It passed the goal, start de-animating it
-                    # Make it negative to show that it should decrease
-                    self._led_status_list[i] *= -1
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                elif (2 + self._speed) < current_animation_amount < self._max_animation_amount: # Moving toward target
-                    if self._mode == 'linear':
-                        self._led_status_list[i] += random.random()
-                        current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                    else:
-                        current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                        # Usually increase the brightness towards the target, but sometimes don't
-                        if random.random() < self._chance_to_increase_brightness:
-                            self._led_status_list[i] /= 2
-                        else:
-                            self._led_status_list[i] += random.random()
-
-                        if random.random() < self._chance_to_change_colors:
-                            self._led_color_list[i] = new_color
-
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                    # Usually increase the brightness towards the target, but sometimes don't
-                    if random.random() < self._chance_to_increase_brightness:
-                        self._led_status_list[i] /= 2
-                    else:
-                        self._led_status_list[i] += random.random()
-
-                    if random.random() < self._chance_to_change_colors:
-                        self._led_color_list[i] = new_color
-
-                elif 0 < current_animation_amount:  # It started animating, don't mess with it
-                    self._led_status_list[i] += random.random()
-                    current_color = blend_colors(current_color, current_color_target, self._speed_to_blend)
-                elif current_animation_amount == 0:  # It is not animating
-                    # Set it towards the target
-                    if random.random() < (self._chance_to_start_a_twinkle**2):
-                        self._led_status_list[i] += random.random()
-                        self._led_color_list[i] = new_color
-                        current_color = blend_colors(current_color, new_color, self._speed_to_blend)
-                elif current_animation_amount > (-1 - self._speed):  # It's close enough to 0, end the animation
-                    self._led_status_list[i] = 0
-                    self._led_color_list[i] = self._starting_color
-                    current_color = self._starting_color
-                else:  # It's negative, so should approach back to 0
-                    self._led_status_list[i] += random.random()
-                    current_color = blend_colors(current_color, self._starting_color, self._speed_to_blend)
-
-                self._strip.setPixelColor(pixel_to_set, current_color)
-
-            except AttributeError as e:
-                log.warn("Color error: current:{} target:{}. {}".format(current_color, self._starting_color, e))
-
+        # Randomly blend every pixel towards a target color, using a state machine (tracked by the
+        # status value of each pixel) to pick how each pixel is animating
+        status = self._led_status
+        current_colors = self._strip.read(self._index)
+        new_color = random_colors_with_range_from_list(self._provided_colors, self._color_variations, .2, 1,
+                                                       self._random)[0]
+        rolls = self._random.random((3, self._pixels_count))
+
+        passed_goal = status >= self._max_animation_amount  # It passed the goal, start de-animating it
+        toward_target = ((2 + self._speed) < status) & (status < self._max_animation_amount)
+        started = (0 < status) & ~passed_goal & ~toward_target  # It started animating, don't mess with it
+        ending = (status < 0) & (status > (-1 - self._speed))  # It's close enough to 0, end the animation
+        returning = status <= (-1 - self._speed)  # It's negative, so should approach back to 0
+
+        # Start some pixels that are not animating towards this frame's new color
+        starting = (status == 0) & (rolls[0] < (self._chance_to_start_a_twinkle**2))
+        self._led_colors[starting] = new_color
+
+        blend_targets = np.where(returning, self._starting_color, self._led_colors)
+        blending = passed_goal | toward_target | started | starting | returning
+        new_colors = np.where(blending, blend_color_arrays(current_colors, blend_targets, self._speed_to_blend),
+                              current_colors)
+        new_colors[ending] = self._starting_color
+
+        # Make it negative to show that it should decrease
+        status[passed_goal] *= -1
+
+        brightening = started | starting | returning
+        if self._mode == 'linear':
+            brightening |= toward_target
+        else:
+            # Usually increase the brightness towards the target, but sometimes don't
+            dimming = toward_target & (rolls[0] < self._chance_to_increase_brightness)
+            status[dimming] /= 2
+            brightening |= toward_target & ~dimming
+            self._led_colors[toward_target & (rolls[2] < self._chance_to_change_colors)] = new_color
+        status[brightening] += rolls[1][brightening]
+
+        status[ending] = 0
+        self._led_colors[ending] = self._starting_color
+
+        self._strip.write(self._index, new_colors)
         self._iteration += 1
+
+
+class PlaybackFrame:
+    """Play back a frame file rendered by Renderer.py, showing each frame at the time it was recorded """
+
+    def __init__(self, strip, strip_id, pixel_ids=None, config=None):
+        super(PlaybackFrame, self).__init__()
+
+        self._pixels_count = len(pixel_ids) if pixel_ids else strip.numPixels()
+        self._strip = strip
+        self._strip_id = strip_id
+        self._pixel_ids = pixel_ids if pixel_ids else range(self._pixels_count)
+        self._index = strip.index(pixel_ids)
+        self._config = config if config else {}
+
+        # Animation Specific variables
+        self.clock = time.monotonic  # Replaced by the clock of the scheduler that runs the frame
+        self._started = None  # Time on the clock that was the start of the file, once playing
+        self._loop = str(self._config.get('loop', 'true')).lower() not in ['false', 'no', 'off', '0']
+        self._shown = None
+        self._frames = None
+        self._delay = 10
+        try:
+            self._file = FrameFile(self._config.get('file', ''))
+        except (OSError, ValueError) as e:
+            log.error("Can't play back frame file '{}': {}".format(self._config.get('file'), e))
+            return
+
+        try:
+            self._position = float(self._config.get('position', 0))  # Seconds into the file to start at
+        except (TypeError, ValueError):
+            self._position = None
+        if self._position is None or not isfinite(self._position) or self._position < 0:
+            log.warning("Can't play back '{}': position '{}' is not a number of seconds".format(
+                self._config.get('file'), self._config.get('position')))
+            return
+
+        try:
+            strand_num = int(self._config.get('strand', strip_id))
+        except (TypeError, ValueError):
+            log.warning("Can't play back '{}': strand '{}' is not a strand number".format(
+                self._config.get('file'), self._config.get('strand')))
+            return
+        if not 0 <= strand_num < len(self._file.strands) or not len(self._file):
+            log.warning("Can't play back '{}': it has no frames for strand {}".format(self._config.get('file'),
+                                                                                    strand_num))
+            return
+        if self._file.strands[strand_num]['leds'] != strip.numPixels():
+            log.warning("Can't play back '{}': strand {} has {} LEDs in the file but {} on the strip".format(
+                self._config.get('file'), strand_num, self._file.strands[strand_num]['leds'], strip.numPixels()))
+            return
+
+        # The file is memory mapped, so frames are read from disk (or the page cache) as they are shown.  For a
+        # contiguous range of LEDs each frame is a view into the file, copied once as it is written to the strip
+        strand_frames = self._file.strand_frames(strand_num)
+        self._frames = strand_frames[:, self._index] if isinstance(self._index, slice) else strand_frames
+
+        # Wake up as often as the closest two frames in the file
+        intervals = np.diff(self._file.times)
+        intervals = intervals[intervals > 0]
+        if len(intervals):
+            self._delay = max(1, int(round(float(intervals.min()) / .01)))
+
+    @property
+    def delay_between_frames(self):
+        # number of 10ms increments to delay before next animation frame should be called
+        return self._delay
+
+    @property
+    def valid(self):
+        # False if the file couldn't be played back on this strip, so the animation isn't started
+        return self._frames is not None
+
+    @property
+    def strip(self):
+        return self._strip
+
+    @property
+    def strip_id(self):
+        return self._strip_id
+
+    def next(self):
+        if self._frames is None:
+            return
+
+        # Played by the clock rather than by counting frames, so frames that run late don't slow playback down
+        now = self.clock()
+        if self._started is None:
+            self._started = now - self._position
+        position = now - self._started
+        duration = self._file.duration
+        if position > duration:
+            # Start over, or keep showing the last frame
+            position = position % duration if self._loop and duration else duration
+            self._started = now - position
+
+        frame = self._file.index_at(position)
+        if frame != self._shown:
+            colors = self._frames[frame]
+            self._strip.write(self._index, colors if isinstance(self._index, slice) else colors[self._index])
+            self._shown = frame
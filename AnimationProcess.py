@@ -1,86 +1,673 @@
+import heapq
+import itertools
 import multiprocessing
-from time import sleep
+import os
+import threading
+import time
 
 import AnimationFrames
 import config
+from Compositor import Compositor, layer_settings
+from FrameCache import frame_cache
+from Metrics import SharedHistogram, TRANSITION_BUCKETS
+from Profiler import EngineProfiler, profile_paths
+
+FRAME_STEP_SECONDS = 0.01  # Animations give delay_between_frames in 10ms steps
+MAX_ANIMATIONS = 128  # Slots available for sharing per-animation frame rates with the web server
+MAX_STRANDS = 16  # Strands whose show() durations are shared with the web server
+FRAME_RATE_FIELDS = 3  # Shared per animation slot: requested fps, actual fps and missed deadlines
+FPS_SMOOTHING = 0.1  # Weight of the newest frame interval in the running actual-fps average
+COMMAND_TIMEOUT_SECONDS = 2
+TRANSITION_FRAME_SECONDS = 0.02  # How often transitions between modes are redrawn
+
+_animation_ids = itertools.count(1)  # Animation ids are handed out by the web server process
+
+# Frame object of each animation, and the animations that replay a period from the frame cache
+ANIMATION_FRAMES = {'rainbow': AnimationFrames.RainbowFrame, 'warp': AnimationFrames.WarpFrame,
+                    'pulsing': AnimationFrames.PulseFrame, 'blinking': AnimationFrames.BlinkFrame,
+                    'blinkenlicht': AnimationFrames.BlinkenlichtFrame, 'twinkle': AnimationFrames.TwinkleFrame,
+                    'playback': AnimationFrames.PlaybackFrame}
+PERIOD_ANIMATIONS = ['rainbow', 'warp', 'pulsing', 'blinking']
+
+
+def sendable_animation_data(animation_data):
+    # Strip objects stay behind, the engine looks strips up by strip_id
+    return {k: v for k, v in animation_data.items() if k != 'strip'}
+
+
+def rendered_periods(animation_data):
+    """Periods an animation replays, rendered into (or found in) this process's frame cache, to send to an
+    engine along with the animation so it doesn't render them again """
+    animation_config = animation_data.get('command_parsed', {})
+    animation = animation_config.get('animation')
+    strand = animation_data.get('strip_id')
+    light_strip = animation_data.get('strip')
+    if light_strip is None and strand is not None and int(strand) < len(config.light_strips):
+        light_strip = config.light_strips[int(strand)]
+    if animation not in PERIOD_ANIMATIONS or light_strip is None:
+        return {}
+
+    # Built on a layer of a scratch compositor, so nothing is drawn on the strip.  Settings the animation can't
+    # use are left for the engine to turn down
+    with frame_cache.recording() as periods:
+        try:
+            ANIMATION_FRAMES[animation](Compositor(light_strip).add_layer(), strand,
+                                        animation_data.get('id_list', []), animation_config)
+        except Exception:
+            return {}
+    return periods
+
+
+def updated_animation_data(animation_data, parameters):
+    """Copy of animation_data with parameters (loop_speed, density, color_list, ...) changed """
+    overrides = dict(animation_data.get('overrides', {}), **parameters)  # Every setting changed so far
+    command_parsed = dict(animation_data.get('command_parsed', {}), **parameters)
+    text = animation_data.get('original_text', command_parsed.get('text'))
+    if text:
+        # Keep the text showing these settings.  It is the original text and the changed settings in order, so
+        # the same settings always give the same text
+        extras = ", ".join("{}:{}".format(k, v) for k, v in sorted(overrides.items()))
+        command_parsed['text'] = "{}, {}".format(text, extras)
+    return dict(animation_data, command_parsed=command_parsed, overrides=overrides, original_text=text)
+
+
+class FrameScheduler:
+    """Keeps a heap of when each animation's next frame is due on a monotonic clock.
+
+    Deadlines advance by each animation's period from the previous deadline rather than from when the
+    frame actually ran, so time spent in next() and show() doesn't accumulate as drift.  An animation
+    that falls more than a whole period behind counts a missed deadline and is re-synced to now.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap = []
+        self._order = itertools.count()  # Breaks ties between animations due at the same time
+        self._stats = {}
+
+    def add(self, anim, slot=None):
+        now = self._clock()
+        if hasattr(anim, 'clock'):
+            anim.clock = self._clock  # Frames played back by the time (eg playback) follow this clock
+        self._stats[id(anim)] = {'slot': slot, 'last_frame': None, 'actual_fps': 0.0, 'missed_deadlines': 0}
+        heapq.heappush(self._heap, (now, next(self._order), anim))
+
+    def now(self):
+        return self._clock()
+
+    def remove(self, anim):
+        # Removed animations are dropped from the heap the next time they come due
+        self._stats.pop(id(anim), None)
+
+    def __len__(self):
+        return len(self._stats)
+
+    def seconds_until_next(self):
+        """Seconds until the next frame is due (0 if overdue), or None if nothing is scheduled """
+        while self._heap and id(self._heap[0][2]) not in self._stats:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self._clock())
+
+    def pop_due(self):
+        """Return every animation whose frame is due, rescheduling each for its next deadline """
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, anim = heapq.heappop(self._heap)
+            stats = self._stats.get(id(anim))
+            if stats is None:
+                continue
+
+            period = anim.delay_between_frames * FRAME_STEP_SECONDS
+            next_deadline = deadline + period
+            if now - next_deadline >= period:
+                # Fell more than a frame behind, skip ahead instead of rushing frames to catch up
+                stats['missed_deadlines'] += 1
+                next_deadline = now + period
+
+            if stats['last_frame'] is not None and now > stats['last_frame']:
+                fps = 1 / (now - stats['last_frame'])
+                stats['actual_fps'] += FPS_SMOOTHING * (fps - stats['actual_fps']) if stats['actual_fps'] else fps
+            stats['last_frame'] = now
+
+            heapq.heappush(self._heap, (next_deadline, next(self._order), anim))
+            due.append(anim)
+        return due
+
+    def stats(self, anim):
+        return self._stats.get(id(anim))
 
 
 class AnimationProcess(multiprocessing.Process):
-    def __init__(self, animations_data=None):
+    """Runs animation frames in their own process.
+
+    Animations added before start() are built in the web server process, and once running (or held as a
+    standby) the engine takes add, remove, replace, update, recolor, transition and stop commands over a pipe,
+    applying each between frames and replying with how long the command took to apply.  Added and replaced
+    animations bring along the periods they replay, rendered in the web server's frame cache, so cached periods
+    are reused across mode switches either way.
+
+    Each animation draws into its own layer of its strip's Compositor, and every strip with a new frame is
+    composited and shown once per loop.
+
+    A held engine is started ahead of time as a standby: it builds the animations it is sent but doesn't show
+    anything until it is told to take over, so a mode switch doesn't wait for a new process to start.
+    """
+    def __init__(self, animations_data=None, cpu=None, held=False):
         super(AnimationProcess, self).__init__()
 
         self._continue_animating = False
-        self._iteration = 0
-        self._animations_frames = []
+        self._held = held
+        self._animations = {}  # animation id -> {'frame': frame object, 'data': animation_data, 'slot': fps slot,
+        #                                        'layer': compositor layer the frame draws into}
+        self._compositors = {}  # strip -> Compositor
+        self._recomposite = []  # Compositors that lost a layer and need to be redrawn
+        self._free_slots = list(range(MAX_ANIMATIONS))
+        self._scheduler = None
+        self._cpu = cpu  # Core to pin this worker to, if any
+        self._profiler = None  # Only set while a profile is being taken
+        self._engine_periods = set()  # Frame cache keys the engine has, as far as the web server knows
+
+        # Requested fps, actual fps and missed deadlines of each animation, written by the animation loop and
+        # read by the web server, along with how long each animation's next() and each strand's show() take
+        self._frame_rates = multiprocessing.RawArray('d', FRAME_RATE_FIELDS * MAX_ANIMATIONS)
+        self._next_durations = SharedHistogram(MAX_ANIMATIONS)
+        self._show_durations = SharedHistogram(MAX_STRANDS)
+        self._strand_rows = {}  # Compositor -> strand number, for show() durations
+        # How long transitions between modes took, and how long each frame of one took to blend
+        self._transition_durations = SharedHistogram(1, TRANSITION_BUCKETS)
+        self._transition_frames = SharedHistogram(1)
+        self._slots_released_later = []  # (when, slot) of animations still fading out in a transition
+        # Worker timing: loop start time, frames rendered, seconds spent rendering and showing, slowest loop,
+        # and when the first frame was shown
+        self._timing = multiprocessing.RawArray('d', 5)
+
+        # Command channel - the web server end is used under a lock, as Flask handles requests in threads
+        self._commands, self._engine_commands = multiprocessing.Pipe()
+        self._command_lock = threading.Lock()
+        self._command_numbers = itertools.count(1)
+        self._pending_commands = 0  # Commands waiting for or being applied by the engine
+        self._pending_lock = threading.Lock()
 
         # Add starting animations if provided
-        self._animations_data = []
         if animations_data and len(animations_data):
             for anim in animations_data:
                 self.add_animation(anim)
 
-    def add_animation(self, animation_data):
-        """Generic Animation controller, triggers correct animation based on options."""
-        self._animations_data.append(animation_data)
+    def add_animation(self, animation_data, animation_id=None, slot=None):
+        """Generic Animation controller, triggers correct animation based on options.  Returns the animation id."""
         animation_config = animation_data.get('command_parsed', {})
         animation = animation_config.get('animation', None)
+        strand = animation_data.get('strip_id')
         light_strip = animation_data.get('strip', None)
+        if light_strip is None and strand is not None and int(strand) < len(config.light_strips):
+            # Commands can't carry strip objects, so look the strip up in this process
+            light_strip = config.light_strips[int(strand)]
 
         if animation and light_strip:
             animation_command = animation_data.get('command', {})
-            strand = animation_data.get('strip_id')
             id_list = animation_data.get('id_list', [])
 
             status = "Adding '{}' animation on strip {} with {} LEDs".format(animation_command, strand, len(id_list))
             config.log.info(status)
 
+            entry = animation_data.get('entry')  # (strip id, entry number) of an animation from the mode's table
+            layer = self._compositor_for(light_strip).add_layer(rank=entry[1] if entry else None,
+                                                                **layer_settings(animation_config))
+            light_strip = layer  # The frame draws into its own layer rather than straight onto the strip
+
             animation_object = None
-            if animation == 'rainbow':
-                animation_object = AnimationFrames.RainbowFrame(light_strip, strand, id_list, animation_config)
-            elif animation == 'warp':
-                animation_object = AnimationFrames.WarpFrame(light_strip, strand, id_list, animation_config)
-            elif animation == 'pulsing':
-                animation_object = AnimationFrames.PulseFrame(light_strip, strand, id_list, animation_config)
-            elif animation == 'blinking':
-                animation_object = AnimationFrames.BlinkFrame(light_strip, strand, id_list, animation_config)
-            elif animation == 'blinkenlicht':
-                animation_object = AnimationFrames.BlinkenlichtFrame(light_strip, strand, id_list, animation_config)
-            elif animation == 'twinkle':
-                animation_object = AnimationFrames.TwinkleFrame(light_strip, strand, id_list, animation_config)
+            if animation in ANIMATION_FRAMES:
+                try:
+                    animation_object = ANIMATION_FRAMES[animation](light_strip, strand, id_list, animation_config)
+                except Exception as e:
+                    # Settings the animation can't use, eg a pulse_height of 0.  It isn't started
+                    config.log.warning("Can't start animation '{}': {!r}".format(animation_command, e))
 
+            if not animation_object or not getattr(animation_object, 'valid', True):
+                layer.compositor.remove_layer(layer)
             else:
-                # TODO: Add more
-                pass
+                animation_id = animation_id or next(_animation_ids)
+                if slot is None:
+                    slot = self._reserve_slot()
+                self._animations[animation_id] = {'frame': animation_object, 'data': animation_data, 'slot': slot,
+                                                  'layer': layer}
+                if slot is not None:
+                    base = FRAME_RATE_FIELDS * slot
+                    self._frame_rates[base] = 1 / (animation_object.delay_between_frames * FRAME_STEP_SECONDS)
+                    self._frame_rates[base + 1] = self._frame_rates[base + 2] = 0
+                    self._next_durations.clear(slot)
+                if self._scheduler is not None and not self._held:
+                    self._scheduler.add(animation_object, slot)
+                return animation_id
 
-            if animation_object:
-                self._animations_frames.append(animation_object)
+    def remove_animation(self, animation_id):
+        entry = self._animations.pop(animation_id, None)
+        if entry is None:
+            return False
+        self._stop_entry(entry)
+        self._release_slot(entry['slot'])
+        return True
+
+    def _stop_entry(self, entry):
+        # Takes an animation off the schedule and its layer off the strip, leaving its slot to the caller
+        if self._scheduler is not None and entry['frame'] is not None:
+            self._scheduler.remove(entry['frame'])
+        if entry.get('layer') is not None:
+            compositor = entry['layer'].compositor
+            compositor.remove_layer(entry['layer'])
+            if compositor not in self._recomposite:
+                self._recomposite.append(compositor)
+
+    def _compositor_for(self, light_strip):
+        if light_strip not in self._compositors:
+            if self._scheduler is not None and not self._held:
+                # Starting on a strip while running, take on whatever it is showing as the static colors
+                light_strip.sync_to_shown()
+            compositor = self._compositors[light_strip] = Compositor(light_strip)
+            strand_numbers = [num for num, strip in enumerate(config.light_strips) if strip is light_strip]
+            if strand_numbers and strand_numbers[0] < MAX_STRANDS:
+                self._strand_rows[compositor] = strand_numbers[0]
+        return self._compositors[light_strip]
+
+    def _reserve_slot(self):
+        now = time.monotonic()
+        for when, slot in list(self._slots_released_later):
+            if when <= now:
+                self._slots_released_later.remove((when, slot))
+                self._free_slots.append(slot)
+        return self._free_slots.pop(0) if self._free_slots else None
+
+    def _release_slot(self, slot):
+        if slot is not None:
+            base = FRAME_RATE_FIELDS * slot
+            self._frame_rates[base:base + FRAME_RATE_FIELDS] = [0.0] * FRAME_RATE_FIELDS
+            self._next_durations.clear(slot)
+            self._free_slots.append(slot)
 
     def run(self):
-        """Cycles through each animation, and if it's time interval has come up, run the next frame """
+        """Waits until the next animation frame is due or a command arrives, runs every frame that is due
+        and shows the changed strips """
         # animation_data = {'strip': strip, 'strip_id': strip_id, 'id_list': id_list, 'animation': animation_name,
         #                  'command': animation_text, 'command_parsed': command_parsed, 'range_name': range_name}
 
-        config.log.info('Animations starting')
+        self._scheduler = FrameScheduler()
+        if self._held:
+            config.log.info('Standby animation process waiting to take over')
+        else:
+            self._start_animating()
+
         # Start the animation loop
         self._continue_animating = True
         while self._continue_animating:
-            self._iteration += 1
+            # Block until the next frame is due (or forever if there is nothing to animate) or a command arrives
+            try:
+                if self._engine_commands.poll(self._seconds_to_wait()):
+                    self._apply_command(self._engine_commands.recv())
+            except EOFError:
+                break  # The web server went away
+            if self._profiler is not None and self._profiler.check():
+                self._profiler = None
+            if self._held:
+                continue
+            self.render_due_frames()
 
-            # Get the next frame from any animation that should trigger based on the time delay
-            strips_shown = []
-            for anim in self._animations_frames:
-                if self._iteration % anim.delay_between_frames == 0:
-                    anim.next()
-                    if anim.strip not in strips_shown:
-                        strips_shown.append(anim.strip)
+        print('AnimationProcess with {} animations halted'.format(len(self._animations)))
 
-            # Show the next step in each light strip that was changed
-            for strip in strips_shown:
-                strip.show()
+    def _seconds_to_wait(self):
+        wait = None if self._held else self._scheduler.seconds_until_next()
+        if not self._held and any(compositor.transitioning for compositor in self._compositors.values()):
+            wait = TRANSITION_FRAME_SECONDS if wait is None else min(wait, TRANSITION_FRAME_SECONDS)
+        if self._profiler is not None:
+            # Wake up when the profile is due to be written, even if nothing is animating
+            wait = self._profiler.seconds_left() if wait is None else min(wait, self._profiler.seconds_left())
+        return wait
 
-            sleep(0.01)  # Sleep 10 ms
+    def start_on_clock(self, clock):
+        """Animate in this process rather than a new one, on a clock the caller advances (eg a simulated clock),
+        calling render_due_frames() whenever seconds_until_next_frame() have passed """
+        self._scheduler = FrameScheduler(clock)
+        self._start_animating()
 
-        print('AnimationProcess with {} animations halted'.format(len(self._animations_data)))
+    def seconds_until_next_frame(self):
+        return self._scheduler.seconds_until_next()
+
+    def render_due_frames(self):
+        """Runs every frame that is due, then composites and shows each strip that changed.  Returns those strips"""
+        # Get the next frame from any animation that is due, each drawing into its layer
+        loop_start = time.monotonic()
+        now = self._scheduler.now()
+        compositors = self._recomposite
+        self._recomposite = []
+        for compositor in self._compositors.values():
+            if compositor.transitioning and compositor not in compositors:
+                compositors.append(compositor)
+        due = self._scheduler.pop_due()
+        for anim in due:
+            frame_start = time.perf_counter()
+            anim.next()
+            frame_time = time.perf_counter() - frame_start
+            if anim.strip.compositor not in compositors:
+                compositors.append(anim.strip.compositor)
+
+            stats = self._scheduler.stats(anim)
+            if stats['slot'] is not None:
+                base = FRAME_RATE_FIELDS * stats['slot']
+                self._frame_rates[base + 1] = stats['actual_fps']
+                self._frame_rates[base + 2] = stats['missed_deadlines']
+                self._next_durations.observe(stats['slot'], frame_time)
+
+        # Stack the layers of each light strip that was changed, then show it
+        for compositor in compositors:
+            if compositor.transitioning:
+                blend_start = time.perf_counter()
+                compositor.composite(now)
+                self._transition_frames.observe(0, time.perf_counter() - blend_start)
+            else:
+                compositor.composite(now)
+            show_start = time.perf_counter()
+            compositor.buffer.show()
+            strand_row = self._strand_rows.get(compositor)
+            if strand_row is not None:
+                self._show_durations.observe(strand_row, time.perf_counter() - show_start)
+
+        self._finish_transitions(now)
+
+        loop_time = time.monotonic() - loop_start
+        if compositors and not self._timing[4]:
+            self._timing[4] = time.monotonic()
+        self._timing[1] += len(due)
+        self._timing[2] += loop_time
+        self._timing[3] = max(self._timing[3], loop_time)
+        return [compositor.buffer for compositor in compositors]
+
+    def _finish_transitions(self, now, compositors=None):
+        # Transitions that have run their time (or all of 'compositors') end, removing the animations that left
+        for compositor in compositors or list(self._compositors.values()):
+            if compositor.transitioning and (compositors or compositor.transition_done(now)):
+                self._transition_durations.observe(0, now - compositor.transition_started())
+                leaving = compositor.end_transition()
+                for animation_id, entry in list(self._animations.items()):
+                    if entry.get('layer') in leaving:
+                        self.remove_animation(animation_id)
+                if compositor not in self._recomposite:
+                    self._recomposite.append(compositor)
+
+    def _start_transition(self, strip_ids, style, seconds, leaving_ids):
+        now = self._scheduler.now()
+        leaving_layers = [self._animations[animation_id]['layer'] for animation_id in leaving_ids
+                          if animation_id in self._animations]
+        for strip_id in strip_ids:
+            if int(strip_id) >= len(config.light_strips):
+                continue
+            compositor = self._compositor_for(config.light_strips[int(strip_id)])
+            self._finish_transitions(now, [compositor])  # A new switch ends a transition still running
+            compositor.start_transition(style, seconds, [layer for layer in leaving_layers
+                                                         if layer.compositor is compositor], now)
+            if compositor not in self._recomposite:
+                self._recomposite.append(compositor)
+
+    def _start_animating(self):
+        if self._cpu is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {self._cpu})
+        config.log.info('Animations starting on cpu {}'.format(self._cpu if self._cpu is not None else 'any'))
+
+        self._held = False
+        self._timing[0] = time.monotonic()
+        for entry in self._animations.values():
+            self._scheduler.add(entry['frame'], entry['slot'])
+
+    def _take_over(self, cpu=None):
+        """Start animating from whatever the strips are showing now, drawing the first frames straight away """
+        for light_strip in config.light_strips:
+            light_strip.sync_to_shown()
+        for compositor in self._compositors.values():
+            compositor.set_base(compositor.buffer.pixels)
+        self._cpu = cpu
+        self._start_animating()
+
+    def _apply_command(self, message):
+        """Runs inside the animation process, between frames.  A command that fails is answered as not ok, and
+        leaves the engine running everything it was before """
+        try:
+            ok = self._run_command(message)
+        except Exception as e:
+            config.log.error("Animation process couldn't apply '{}': {!r}".format(message.get('command'), e))
+            ok = False
+
+        latency = time.monotonic() - message.get('sent', time.monotonic())
+        self._engine_commands.send({'number': message.get('number'), 'ok': ok,
+                                    'apply_latency_ms': round(1000 * latency, 3)})
+
+    def _run_command(self, message):
+        action = message.get('command')
+        animation_id = message.get('animation_id')
+        ok = True
+        frame_cache.preload(message.get('periods') or {})
+        if action == 'add':
+            ok = self.add_animation(message['animation_data'], animation_id, message.get('slot')) is not None
+        elif action == 'remove':
+            ok = self.remove_animation(animation_id)
+        elif action in ['replace', 'update']:
+            entry = self._animations.get(animation_id)
+            if entry is None:
+                ok = False
+            else:
+                if action == 'replace':
+                    animation_data = message['animation_data']
+                else:
+                    animation_data = updated_animation_data(entry['data'], message.get('parameters', {}))
+                # The new animation is built first, so the old one keeps running if it can't be
+                ok = self.add_animation(animation_data, animation_id, entry['slot']) is not None
+                if ok:
+                    self._stop_entry(entry)
+        elif action == 'transition':
+            self._start_transition(message.get('strip_ids', []), message.get('style', 'crossfade'),
+                                   float(message.get('seconds', 1)), message.get('leaving', []))
+        elif action == 'recolor':
+            strip_id = message.get('strip_id')
+            ok = strip_id is not None and int(strip_id) < len(config.light_strips)
+            if ok:
+                compositor = self._compositor_for(config.light_strips[int(strip_id)])
+                compositor.recolor(message['ids'], message['colors'])
+                if compositor not in self._recomposite:
+                    self._recomposite.append(compositor)
+        elif action == 'profile':
+            ok = self._profiler is None
+            if ok:
+                self._profiler = EngineProfiler(message['seconds'], message['mode'], message['paths'],
+                                                message.get('sort', 'cumulative'))
+        elif action == 'takeover':
+            ok = self._held
+            if ok:
+                self._take_over(message.get('cpu'))
+        elif action == 'stop':
+            # Finish up after this command, the current frame was already shown
+            self._continue_animating = False
+        else:
+            ok = False
+        return ok
+
+    # Web server side of the command channel
+    def command(self, action, timeout=COMMAND_TIMEOUT_SECONDS, **arguments):
+        """Send a command to the running engine and wait for it to be applied """
+        if not self.is_alive():
+            return {'ok': False, 'message': 'Animation process is not running'}
+
+        with self._pending_lock:
+            self._pending_commands += 1
+        try:
+            with self._command_lock:
+                number = next(self._command_numbers)
+                self._commands.send(dict(arguments, command=action, number=number, sent=time.monotonic()))
+                deadline = time.monotonic() + timeout
+                while self._commands.poll(max(0.0, deadline - time.monotonic())):
+                    reply = self._commands.recv()
+                    if reply.get('number') == number:  # Skip replies to earlier commands that timed out
+                        reply['message'] = "{} {} in {}ms".format(
+                            action, 'applied' if reply['ok'] else 'failed', reply['apply_latency_ms'])
+                        return reply
+            return {'ok': False, 'message': '{} timed out after {}s'.format(action, timeout)}
+        finally:
+            with self._pending_lock:
+                self._pending_commands -= 1
+
+    def start(self):
+        # The engine is forked with a copy of this process's frame cache
+        self._engine_periods = set(frame_cache.keys())
+        super(AnimationProcess, self).start()
+
+    def _periods_to_send(self, animation_data):
+        # Periods of an animation the engine doesn't have yet.  If it has since evicted one, it renders it again
+        periods = {key: frames for key, frames in rendered_periods(animation_data).items()
+                   if key not in self._engine_periods}
+        self._engine_periods.update(periods)
+        return periods
+
+    def send_add(self, animation_data):
+        animation_id = next(_animation_ids)
+        slot = self._reserve_slot()
+        periods = self._periods_to_send(animation_data)
+        animation_data = sendable_animation_data(animation_data)
+        reply = self.command('add', animation_id=animation_id, slot=slot, animation_data=animation_data,
+                             periods=periods)
+        if reply['ok']:
+            self._animations[animation_id] = {'frame': None, 'data': animation_data, 'slot': slot}
+            reply['animation_id'] = animation_id
+        else:
+            self._release_slot(slot)
+        return reply
+
+    def send_remove(self, animation_id):
+        reply = self.command('remove', animation_id=animation_id)
+        if reply['ok']:
+            self.remove_animation(animation_id)
+        return reply
+
+    def send_replace(self, animation_id, animation_data):
+        periods = self._periods_to_send(animation_data)
+        animation_data = sendable_animation_data(animation_data)
+        reply = self.command('replace', animation_id=animation_id, animation_data=animation_data, periods=periods)
+        if reply['ok']:
+            self._animations[animation_id]['data'] = animation_data
+        return reply
+
+    def send_update(self, animation_id, parameters):
+        entry = self._animations.get(animation_id)
+        animation_data = updated_animation_data(entry['data'], parameters) if entry else None
+        periods = self._periods_to_send(animation_data) if animation_data else {}
+        reply = self.command('update', animation_id=animation_id, parameters=parameters, periods=periods)
+        if reply['ok'] and entry:
+            entry['data'] = animation_data
+        return reply
+
+    def send_transition(self, strip_ids, style, seconds, leaving=None):
+        """Start a transition between modes on these strips.  Animations in 'leaving' fade out, and are removed
+        when it ends, static colors changed and animations added meanwhile fade in """
+        leaving = list(leaving or [])
+        reply = self.command('transition', strip_ids=list(strip_ids), style=style, seconds=seconds, leaving=leaving)
+        if reply['ok']:
+            for animation_id in leaving:
+                entry = self._animations.pop(animation_id, None)
+                if entry and entry['slot'] is not None:
+                    # The engine still uses the slot until the animation has faded out
+                    self._slots_released_later.append((time.monotonic() + seconds + COMMAND_TIMEOUT_SECONDS,
+                                                       entry['slot']))
+        return reply
+
+    def send_recolor(self, strip_id, ids, colors):
+        """Change the static colors under a strip's animations """
+        return self.command('recolor', strip_id=strip_id, ids=list(map(int, ids)), colors=list(map(int, colors)))
+
+    def profile(self, seconds, mode='stats', sort='cumulative', folder='profiles'):
+        """Profile the running engine for a number of seconds, see Profiler.py.  The reply's paths are where the
+        profile will be written once the time is up """
+        paths = profile_paths(folder, 'engine-{}'.format(self.pid), mode)
+        reply = self.command('profile', seconds=seconds, mode=mode, sort=sort, paths=paths)
+        if reply['ok']:
+            reply['paths'] = paths
+        return reply
+
+    def take_over(self, cpu=None):
+        """Tell a held (standby) engine to start showing its animations """
+        reply = self.command('takeover', cpu=cpu)
+        if reply['ok']:
+            self._held = False
+            self._cpu = cpu
+        return reply
+
+    @property
+    def held(self):
+        return self._held
+
+    def stop(self, timeout=COMMAND_TIMEOUT_SECONDS):
+        """Cooperative stop - the engine finishes the frame it is on, then exits """
+        reply = self.command('stop', timeout=timeout)
+        if reply['ok']:
+            self.join(timeout)
+        return reply
 
     def halt(self):
-        self._continue_animating = False
+        return self.stop()
+
+    def first_frame_time(self):
+        """When (on the time.monotonic clock, shared by all processes) this worker first showed a frame """
+        return self._timing[4] or None
+
+    def has_animation(self, animation_id):
+        return animation_id in self._animations
+
+    def animations(self):
+        """Id and animation_data of every animation, read from a copy as request threads change them """
+        return [(animation_id, entry['data']) for animation_id, entry in list(self._animations.items())]
+
+    def animations_on(self, strip_id):
+        """Id and animation_data of every animation on a strip """
+        return [(animation_id, data) for animation_id, data in self.animations() if data.get('strip_id') == strip_id]
+
+    def frame_rates(self):
+        """Requested vs actual frames per second of each animation, readable from the web server process.  Request
+        threads add and remove animations meanwhile, so this reads a copy of the animations """
+        rates = []
+        for animation_id, entry in list(self._animations.items()):
+            data = entry['data']
+            details = {'id': animation_id, 'animation': data.get('command_parsed', {}).get('animation'),
+                       'strip_id': data.get('strip_id'), 'range_name': data.get('range_name')}
+            if entry['slot'] is not None:
+                base = FRAME_RATE_FIELDS * entry['slot']
+                details['requested_fps'] = round(self._frame_rates[base], 1)
+                details['actual_fps'] = round(self._frame_rates[base + 1], 1)
+                details['missed_deadlines'] = int(self._frame_rates[base + 2])
+            rates.append(details)
+        return rates
+
+    def next_durations(self):
+        """(animation id, histogram snapshot) of how long each animation's next() takes """
+        return [(animation_id, self._next_durations.snapshot(entry['slot']))
+                for animation_id, entry in list(self._animations.items()) if entry['slot'] is not None]
+
+    def show_durations(self, strand_count):
+        """Histogram snapshot of how long show() takes on each of the first strand_count strands """
+        return [self._show_durations.snapshot(row) for row in range(min(strand_count, MAX_STRANDS))]
+
+    @property
+    def duration_buckets(self):
+        return self._next_durations.bounds
+
+    def transition_durations(self):
+        """Histogram snapshots of how long whole transitions took, and how long each of their frames took """
+        return self._transition_durations.snapshot(0), self._transition_frames.snapshot(0)
+
+    def pending_commands(self):
+        """Commands from the web server (and MQTT) waiting for this engine to apply them """
+        return self._pending_commands
+
+    def timing(self):
+        """How busy this worker is, readable from the web server process """
+        started, frames, busy_seconds, slowest_loop, _ = self._timing[:]
+        running_seconds = time.monotonic() - started if started else 0
+        return {'frames': int(frames),
+                'busy_ms_per_frame': round(1000 * busy_seconds / frames, 3) if frames else 0,
+                'slowest_loop_ms': round(1000 * slowest_loop, 3),
+                'load': round(busy_seconds / running_seconds, 4) if running_seconds else 0}
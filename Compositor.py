@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Layered compositing of the animations running on one strip.
+
+Each animation renders into its own Layer (which answers the same index/write/read calls as a FrameBuffer),
+and once per frame the strip's Compositor stacks the layers in z-order over the strip's static colors and
+writes the result to the FrameBuffer in one vectorized pass.  Layers can be partly transparent (opacity)
+and combine with what is under them by replacing, adding, multiplying or taking the brighter channel.
+
+Layer settings come from the animation text, eg "red and blue, twinkle, layer:2, opacity:.5, blend:add"
+
+A compositor can also transition between modes: while a transition runs, the layers that are leaving are
+stacked over the old static colors and the rest over the new ones, and the two results are blended into one
+frame - faded evenly (crossfade), swept along the strip (wipe) or pixel by pixel in a random order (dissolve).
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import itertools
+import numpy as np
+import config
+from FrameBuffer import unpack_colors, pack_colors, blend_color_arrays
+
+BLEND_MODES = ['replace', 'add', 'multiply', 'max']
+TRANSITIONS = ['snap', 'crossfade', 'wipe', 'dissolve']
+
+
+def layer_settings(animation_config):
+    """Read the layer, opacity and blend settings of an animation, falling back to an opaque replace layer """
+    settings = {'z': 0, 'opacity': 1.0, 'blend': 'replace'}
+    try:
+        settings['z'] = int(animation_config.get('layer', 0))
+        settings['opacity'] = min(1.0, max(0.0, float(animation_config.get('opacity', 1.0))))
+    except (TypeError, ValueError):
+        config.log.warning("Invalid layer or opacity in animation '{}'".format(animation_config.get('text')))
+
+    blend = str(animation_config.get('blend', 'replace')).strip()
+    if blend in BLEND_MODES:
+        settings['blend'] = blend
+    else:
+        config.log.warning("Unknown blend '{}', valid blends are {}".format(blend, BLEND_MODES))
+    return settings
+
+
+def blend_layer(under, over, blend='replace', opacity=1.0):
+    """Combine packed colors 'over' onto 'under' with one of the BLEND_MODES, then fade by opacity """
+    if blend == 'replace' and opacity >= 1:
+        return over
+
+    under_rgb = unpack_colors(under).astype(np.float64)
+    over_rgb = unpack_colors(over).astype(np.float64)
+    if blend == 'add':
+        mixed = np.minimum(under_rgb + over_rgb, 255)
+    elif blend == 'multiply':
+        mixed = under_rgb * over_rgb / 255
+    elif blend == 'max':
+        mixed = np.maximum(under_rgb, over_rgb)
+    else:
+        mixed = over_rgb
+
+    if opacity < 1:
+        mixed = under_rgb + (mixed - under_rgb) * opacity
+    return pack_colors(mixed)
+
+
+class Layer:
+    """Pixels drawn by one animation, along with which pixels it has drawn """
+    def __init__(self, compositor, order, z=0, opacity=1.0, blend='replace', rank=None):
+        self._compositor = compositor
+        self._order = order
+        self._rank = float('inf') if rank is None else rank
+        self._count = compositor.buffer.numPixels()
+        self._start = self._end = None
+
+        self.pixels = np.zeros(self._count, dtype=np.uint32)
+        self.covered = np.zeros(self._count, dtype=bool)
+        self.z = z
+        self.opacity = opacity
+        self.blend = blend
+        self.transition = None  # 'leaving' or 'incoming' while the compositor transitions between modes
+
+    @property
+    def compositor(self):
+        return self._compositor
+
+    @property
+    def sort_key(self):
+        # Lower z is drawn first.  Layers on the same z stack by rank (the order of their ranges and ids in the
+        # mode, so restarting a range in a mode switch doesn't lift it over the ids), then in the order added
+        return self.z, self._rank, self._order
+
+    @property
+    def span(self):
+        """Start and end of the pixels this layer has drawn, or None if it hasn't drawn any yet """
+        return None if self._start is None else (self._start, self._end)
+
+    # FrameBuffer calls used by the animation frames
+    def index(self, pixel_ids=None):
+        return self._compositor.buffer.index(pixel_ids)
+
+    def write(self, index, colors):
+        self.pixels[index] = colors
+        if self._start is None or not self.covered[index].all():
+            self.covered[index] = True
+            covered_ids = np.flatnonzero(self.covered)
+            self._start, self._end = int(covered_ids[0]), int(covered_ids[-1]) + 1
+
+    def read(self, index):
+        return self.pixels[index]
+
+    def numPixels(self):
+        return self._count
+
+
+class Compositor:
+    """Stack of layers over one FrameBuffer """
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._base = buffer.pixels.copy()  # Static colors, shown wherever no layer has drawn
+        self._out = np.empty_like(self._base)  # Reused every frame, so compositing doesn't allocate
+        self._layers = []
+        self._order = itertools.count()
+        self._released = None  # Span of removed layers, still to be restored to the static colors
+        self._transition = None  # Style, timing, old static colors and span of a transition between modes
+        self._incoming = np.empty_like(self._base)
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    @property
+    def layers(self):
+        return list(self._layers)
+
+    def set_base(self, pixels):
+        """Change the static colors shown wherever no layer has drawn """
+        self._base = np.array(pixels, dtype=np.uint32)
+        self._released = (0, len(self._base))
+
+    def recolor(self, index, colors):
+        """Change the static colors of some pixels, eg the ranges that changed in a mode switch """
+        self._base[index] = colors
+        ids = np.arange(len(self._base))[index]
+        if len(ids):
+            span = (int(ids.min()), int(ids.max()) + 1)
+            self._released = self._union(self._released, span)
+            if self._transition:
+                self._transition['span'] = self._union(self._transition['span'], span)
+
+    def start_transition(self, style, seconds, leaving, now):
+        """Blend from the current static colors and layers to the new ones over 'seconds'.  'leaving' layers
+        are faded out, static colors changed and layers added until the transition ends are faded in """
+        order = None
+        if style == 'wipe':
+            order = np.linspace(0, 1, len(self._base), endpoint=False)
+        elif style == 'dissolve':
+            order = np.random.default_rng().random(len(self._base))
+
+        span = None
+        for layer in leaving:
+            layer.transition = 'leaving'
+            span = self._union(span, layer.span)
+        self._transition = {'style': style, 'started': now, 'seconds': max(seconds, 1e-6), 'order': order,
+                            'old_base': self._base.copy(), 'span': span}
+
+    @property
+    def transitioning(self):
+        return self._transition is not None
+
+    def transition_started(self):
+        return self._transition['started'] if self._transition else None
+
+    def transition_done(self, now):
+        return self._transition is not None and now - self._transition['started'] >= self._transition['seconds']
+
+    def end_transition(self):
+        """Finish a transition, returning the layers that left (still to be removed) """
+        leaving = [layer for layer in self._layers if layer.transition == 'leaving']
+        for layer in self._layers:
+            layer.transition = None
+        if self._transition:
+            self._released = self._union(self._released, self._transition['span'])
+        self._transition = None
+        return leaving
+
+    def add_layer(self, z=0, opacity=1.0, blend='replace', rank=None):
+        layer = Layer(self, next(self._order), z, opacity, blend, rank)
+        if self._transition:
+            layer.transition = 'incoming'
+        self._layers.append(layer)
+        self._layers.sort(key=lambda l: l.sort_key)
+        return layer
+
+    def remove_layer(self, layer):
+        if layer in self._layers:
+            self._layers.remove(layer)
+            self._released = self._union(self._released, layer.span)
+
+    @staticmethod
+    def _union(span, other):
+        if span is None or other is None:
+            return span or other
+        return min(span[0], other[0]), max(span[1], other[1])
+
+    def composite(self, now=None):
+        """Draw every layer over the static colors and write the result into the FrameBuffer """
+        span = self._released
+        for layer in self._layers:
+            span = self._union(span, layer.span)
+        self._released = None
+        if self._transition:
+            span = self._union(span, self._transition['span'])
+        if span is None:
+            return
+
+        start, end = span
+        out = self._out[start:end]
+        if not self._transition:
+            self._stack(out, self._base, start, end)
+        else:
+            # The old mode and the new one, blended by how far through the transition it is
+            transition = self._transition
+            incoming = self._incoming[start:end]
+            self._stack(out, transition['old_base'], start, end, skip='incoming')
+            self._stack(incoming, self._base, start, end, skip='leaving')
+            progress = min(1.0, max(0.0, (now - transition['started']) / transition['seconds']))
+            if transition['order'] is None:
+                weight = progress
+            else:
+                weight = transition['order'][start:end] < progress
+            out[:] = blend_color_arrays(out, incoming, weight)
+        self._buffer.write(slice(start, end), out)
+
+    def _stack(self, out, base, start, end, skip=None):
+        np.copyto(out, base[start:end])
+        for layer in self._layers:
+            if layer.span is None or (skip and layer.transition == skip):
+                continue
+            covered = layer.covered[start:end]
+            over = blend_layer(out, layer.pixels[start:end], layer.blend, layer.opacity)
+            np.copyto(out, over, where=covered)
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the loaded settings and the compiled mode tables, so a restart with unchanged config files
+skips parsing the YAML and compiling every animation text.
+
+The cache is keyed by the name, modification time and content hash of each config file, and a hash of the code
+that builds what it holds, and is thrown away whenever any of them differ (or it can't be read).  It holds the
+secrets too, so only the owner can read it.  When the YAML does need parsing, the C loader from libyaml is used
+if PyYAML was built with it.
+
+Set 'config_cache: false' in config.yaml to stop using the cache.  Changing config.yaml means the cache no
+longer matches, so the next start parses the YAML, sees the setting and removes the cache file, and every start
+after that goes straight to parsing.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import hashlib
+import os
+import pickle
+import yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+CONFIG_CACHE_FILE = 'config.cache'
+CACHE_FILE_MODE = 0o600
+SOURCE_FILES = ['ConfigCache.py', 'ModeTables.py', 'includes.py']  # Code that decides what the cache holds
+
+_key = None  # Key of the config files as they were loaded
+_entry = None  # {'key', 'settings', 'mode_tables'} as read from or written to the cache
+
+
+def yaml_load(stream):
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def source_hash():
+    # Hash of the code that builds the settings and mode tables, so an upgrade doesn't read an old cache
+    digest = hashlib.sha256()
+    for filename in SOURCE_FILES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+def cache_key(filenames):
+    """Hash of the code, then name, modification time and content hash of each config file that exists """
+    key = [source_hash()]
+    for filename in filenames:
+        if os.path.exists(filename):
+            with open(filename, 'rb') as conf_file:
+                digest = hashlib.sha256(conf_file.read()).hexdigest()
+            key.append((filename, os.stat(filename).st_mtime_ns, digest))
+    return key
+
+
+def load(filenames, path=CONFIG_CACHE_FILE):
+    """Settings cached from the config files, or None if there is no cache for them as they are now """
+    global _key, _entry
+    _key = cache_key(filenames)
+    _entry = None
+    try:
+        with open(path, 'rb') as cache_file:
+            entry = pickle.load(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('key') != _key:
+        return None
+    settings = pickle.loads(entry['settings'])
+    if not settings.get('config_cache', True):
+        return None
+    _entry = entry
+    return settings
+
+
+def save_settings(settings, path=CONFIG_CACHE_FILE):
+    """Cache settings just loaded from the config files, or remove the cache if they turn it off.  Returns False
+    if the cache couldn't be written or removed """
+    global _entry
+    if _key is None:
+        return True
+    if not settings.get('config_cache', True):
+        _entry = None
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+    _entry = {'key': _key, 'settings': pickle.dumps(settings), 'mode_tables': None}
+    return _write(path)
+
+
+def compiled_tables(strand_sizes):
+    """Mode tables cached with the settings, if they were compiled for the same strand sizes """
+    if _entry is None or _entry.get('mode_tables') is None:
+        return None
+    try:
+        tables = pickle.loads(_entry['mode_tables'])
+    except (pickle.UnpicklingError, AttributeError, ImportError, ValueError, EOFError):
+        return None
+    return tables if tables.strand_sizes == list(strand_sizes) else None
+
+
+def save_tables(tables, path=CONFIG_CACHE_FILE):
+    """Add mode tables compiled from the cached settings to the cache.  Returns False if it couldn't be written """
+    if _entry is None:
+        return True
+    _entry['mode_tables'] = pickle.dumps(tables)
+    return _write(path)
+
+
+def _write(path):
+    # Written to a temporary file first, so a restart part way through never reads half a cache
+    try:
+        with open(path + '.tmp', 'wb', opener=_private_opener) as cache_file:
+            os.chmod(cache_file.fileno(), CACHE_FILE_MODE)  # Even if the temporary file was left by an older version
+            pickle.dump(_entry, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        return False
+    return True
+
+
+def _private_opener(path, flags):
+    return os.open(path, flags, CACHE_FILE_MODE)
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Per-strip pixel buffer backed by a contiguous NumPy uint32 array.
+
+Animation frames write whole ranges of pixels into the buffer (by slice or by an array of ids),
+and the buffer is pushed to the PixelStrip in one bulk copy right before show().  The buffer
+also answers the PixelStrip calls the rest of the app uses (setPixelColor, getPixelColorRGB,
+numPixels, show), so it can be used anywhere a strip is expected.
+
+If the buffer has an OutputStage, the frame is gamma corrected, dimmed and put in the strip's color order
+on the way out, so the pixels (and snapshots) always hold the colors animations asked for.  A PowerLimiter
+then scales the outgoing frame down if it would draw more current than the strand's budget.
+
+Writes are tracked as a dirty range of pixels, and show() compares that range against the frame last
+sent to the strip - if nothing changed, the (blocking) strip.show() is skipped and counted instead.
+
+Every show() also publishes the frame into shared memory guarded by a sequence counter (odd while
+a frame is being written), so the web server can read the colors the forked animation process is
+actually showing with snapshot(), without any messages between the processes.
+
+Colors are stored in the same packed 0xWWRRGGBB format as includes.RGBW
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import atexit
+import ctypes
+import os
+import time
+import numpy as np
+import config
+from multiprocessing import shared_memory
+from includes import RGBW, color_range_amounts
+from OutputStage import OutputStage
+
+try:
+    import _rpi_ws281x as ws
+except ImportError:
+    ws = None
+
+# uint32 counters at the start of each strip's shared memory, before the shown pixels
+SHARED_HEADER_FIELDS = ['sequence', 'shows', 'shows_skipped']
+SNAPSHOT_RETRIES = 100
+
+# Used for random colors when no animation's own generator is given
+default_random = np.random.default_rng()
+
+
+class FrameBuffer:
+    def __init__(self, strip, output=None, power=None):
+        self._strip = strip
+        self._count = strip.numPixels()
+        self._led_data_address = None
+        self._output = output
+        self._power = power
+        self._resend = False  # Set when the output stage changes, so an unchanged frame is sent again
+
+        # Start with whatever the strip currently holds
+        self.pixels = np.zeros(self._count, dtype=np.uint32)
+        for i in range(self._count):
+            self.pixels[i] = int(strip.getPixelColor(i))
+
+        # What the strip was last sent, and the range of pixels written since then
+        self._sent = self.pixels.copy()
+        self._dirty_start = self._dirty_end = None
+
+        # Shared with every process forked after this, so they all see the most recently shown frame
+        header_size = 4 * len(SHARED_HEADER_FIELDS)
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=header_size + self.pixels.nbytes)
+        self._shared_header = np.ndarray((len(SHARED_HEADER_FIELDS),), dtype=np.uint32,
+                                         buffer=self._shared_memory.buf)
+        self._shared_pixels = np.ndarray((self._count,), dtype=np.uint32, buffer=self._shared_memory.buf,
+                                         offset=header_size)
+        self._shared_header[:] = 0
+        self._shared_pixels[:] = self.pixels
+        self._shared_memory_owner = os.getpid()
+        atexit.register(self._release_shared_memory)
+
+    @property
+    def strip(self):
+        return self._strip
+
+    # Bulk access used by the animation frames
+    def index(self, pixel_ids=None):
+        """Return the fastest index into pixels for a list of ids - a slice if they are one
+        contiguous ascending run, otherwise an integer array for fancy indexing """
+        if pixel_ids is None or len(pixel_ids) == 0:
+            return slice(0, self._count)
+
+        ids = np.asarray(pixel_ids, dtype=np.intp)
+        if len(ids) == 1 or np.all(np.diff(ids) == 1):
+            return slice(int(ids[0]), int(ids[-1]) + 1)
+        return ids
+
+    def write(self, index, colors):
+        # colors can be a single packed color or an array with one color per indexed pixel
+        self.pixels[index] = colors
+        if isinstance(index, slice):
+            start, end, _ = index.indices(self._count)
+        else:
+            start, end = int(index.min()), int(index.max()) + 1
+        self.mark_dirty(start, end)
+
+    def read(self, index):
+        return self.pixels[index]
+
+    def mark_dirty(self, start=0, end=None):
+        end = self._count if end is None else end
+        self._dirty_start = start if self._dirty_start is None else min(self._dirty_start, start)
+        self._dirty_end = end if self._dirty_end is None else max(self._dirty_end, end)
+
+    def show(self):
+        """Send the frame to the strip, unless nothing has changed since the last one sent """
+        start, end = self._dirty_start, self._dirty_end
+        self._dirty_start = self._dirty_end = None
+        resend, self._resend = self._resend, False
+        if resend:
+            start, end = 0, self._count
+        elif start is None or np.array_equal(self.pixels[start:end], self._sent[start:end]):
+            self._shared_header[SHARED_HEADER_FIELDS.index('shows_skipped')] += 1
+            return False
+
+        self._sent[start:end] = self.pixels[start:end]
+        self._publish(start, end)
+        self._push_to_strip()
+        self._strip.show()
+        self._shared_header[SHARED_HEADER_FIELDS.index('shows')] += 1
+        return True
+
+    def _publish(self, start, end):
+        sequence = SHARED_HEADER_FIELDS.index('sequence')
+        self._shared_header[sequence] += 1  # Odd while the frame is being copied
+        self._shared_pixels[start:end] = self.pixels[start:end]
+        self._shared_header[sequence] += 1
+
+    def resend(self):
+        """Send the whole frame on the next show(), even if it hasn't changed """
+        self._resend = True
+
+    def sync_to_shown(self):
+        """Take on the frame most recently shown by any process, eg when taking over from another process """
+        self.pixels[:] = self.snapshot()
+        self._sent[:] = self.pixels
+        self._dirty_start = self._dirty_end = None
+
+    def show_counts(self):
+        """How many times show() sent a frame to the strip, and how many unchanged frames it skipped """
+        return {'shows': int(self._shared_header[SHARED_HEADER_FIELDS.index('shows')]),
+                'shows_skipped': int(self._shared_header[SHARED_HEADER_FIELDS.index('shows_skipped')])}
+
+    def _release_shared_memory(self):
+        # Only the process that created the shared memory removes it
+        if os.getpid() == self._shared_memory_owner:
+            self._shared_header = self._shared_pixels = None
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+
+    @property
+    def sequence(self):
+        """Count of frames shown on this strip by any process, doubled """
+        return int(self._shared_header[SHARED_HEADER_FIELDS.index('sequence')])
+
+    def snapshot(self):
+        """Return a consistent copy of the last frame shown by whichever process is animating this strip """
+        sequence = SHARED_HEADER_FIELDS.index('sequence')
+        for attempt in range(SNAPSHOT_RETRIES):
+            before = int(self._shared_header[sequence])
+            if before % 2 == 0:
+                pixels = self._shared_pixels.copy()
+                if int(self._shared_header[sequence]) == before:
+                    return pixels
+            time.sleep(0)
+        return self._shared_pixels.copy()
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def power(self):
+        return self._power
+
+    def power_info(self):
+        return self._power.info() if self._power else None
+
+    def set_output(self, output):
+        self._output = output
+        self.resend()
+
+    def _push_to_strip(self):
+        """Copy the whole buffer into the strip's LED memory in one operation """
+        pixels = self._output.apply(self.pixels) if self._output else self.pixels
+        if self._power:
+            pixels = self._power.limit(pixels)
+        if hasattr(self._strip, 'setPixels'):
+            # rpi_fake.PixelStrip
+            self._strip.setPixels(pixels)
+            return
+
+        if ws is not None and getattr(self._strip, '_channel', None) is not None:
+            # rpi_ws281x.PixelStrip - the channel's led array only exists after begin()
+            if self._led_data_address is None:
+                self._led_data_address = int(ws.ws2811_channel_t_leds_get(self._strip._channel))
+            if self._led_data_address:
+                ctypes.memmove(self._led_data_address, pixels.ctypes.data, pixels.nbytes)
+                return
+
+        for i in range(self._count):
+            self._strip.setPixelColor(i, int(pixels[i]))
+
+    # PixelStrip compatible calls
+    def begin(self):
+        self._strip.begin()
+
+    def numPixels(self):
+        return self._count
+
+    def setPixelColor(self, n, color):
+        self.pixels[n] = color
+        self.mark_dirty(n, n + 1)
+
+    def setPixelColorRGB(self, n, red, green, blue, white=0):
+        self.pixels[n] = RGBW(red, green, blue, white)
+        self.mark_dirty(n, n + 1)
+
+    def getPixelColor(self, n):
+        return RGBW(int(self.pixels[n]))
+
+    def getPixelColorRGB(self, n):
+        return RGBW(int(self.pixels[n]))
+
+    def getPixelColorRGBW(self, n):
+        return RGBW(int(self.pixels[n]))
+
+    def getPixels(self):
+        return self.pixels
+
+    def getBrightness(self):
+        if self._output:
+            return self._output.brightness
+        return self._strip.getBrightness()
+
+    def setBrightness(self, brightness):
+        if self._output:
+            output = self._output
+            self.set_output(OutputStage(output.gamma, brightness, output.color_order))
+        else:
+            self._strip.setBrightness(brightness)
+
+
+def unpack_colors(colors):
+    """Split packed colors into an (..., 3) array of red, green, blue channel values """
+    colors = np.asarray(colors, dtype=np.uint32)
+    return np.stack(((colors >> 16) & 0xff, (colors >> 8) & 0xff, colors & 0xff), axis=-1)
+
+
+def pack_colors(rgb):
+    """Combine an (..., 3) array of red, green, blue channel values back into packed colors """
+    rgb = np.asarray(rgb).astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+def blend_color_arrays(c1, c2, percentage):
+    """Vectorized includes.blend_colors - c1, c2 and percentage can each be single values or arrays """
+    percentage = np.asarray(percentage, dtype=np.float64)[..., np.newaxis]
+    mixed = (unpack_colors(c1) * (1 - percentage)) + (unpack_colors(c2) * percentage)
+    return pack_colors(mixed)
+
+
+def random_generator(seed=None):
+    """NumPy random generator for one animation, repeatable when given a seed (eg 'seed:42' in the animation
+    text), otherwise seeded from the OS """
+    try:
+        seed = None if seed is None or str(seed).strip() == '' else int(seed)
+    except ValueError:
+        config.log.warning("Invalid seed '{}', using a random one".format(seed))
+        seed = None
+    return np.random.default_rng(seed)
+
+
+def random_color_range_array(colors, ranges, rng=None):
+    """Vectorized includes.random_color_range - vary each color by up to 'ranges' (percentages for
+    all of the colors, or an (N, 3) array of 0..255 amounts with one row per color) """
+    rng = rng if rng is not None else default_random
+    rgb = unpack_colors(colors).astype(np.int64)
+    if not isinstance(ranges, np.ndarray):
+        ranges = np.array(color_range_amounts(ranges), dtype=np.int64)
+    varied = rgb + rng.integers(-ranges, ranges + 1, size=rgb.shape)
+    return pack_colors(np.clip(varied, 0, 255))
+
+
+def random_colors_with_range_from_list(colors, variations, default_variation=.2, count=1, rng=None):
+    """Vectorized includes.random_color_with_range_from_list - pick 'count' random colors from the list,
+    each varied by the range that goes with it """
+    rng = rng if rng is not None else default_random
+    color_choices = rng.integers(0, len(colors), size=count)
+    color_array = np.asarray(colors, dtype=np.uint32)
+    ranges = np.array([color_range_amounts(variations[i] if len(variations) > i else [default_variation])
+                       for i in range(len(colors))], dtype=np.int64)
+    return random_color_range_array(color_array[color_choices], ranges[color_choices], rng)
+
+
+def colors_from_list_with_range(parsed_animation, count=1, rng=None):
+    """Vectorized includes.color_from_list_with_range - 'count' static colors picked from an animation's color
+    list, varied only by a range written with that color (black if there are no colors) """
+    colors = parsed_animation.get('color_list', [])
+    if not len(colors):
+        return np.zeros(count, dtype=np.uint32)
+    return random_colors_with_range_from_list(colors, parsed_animation.get('color_variations', []), 0, count, rng)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Cache of pre-rendered periods for animations that repeat exactly (pulsing, warp, blinking, rainbow).
+
+One full period of frames is rendered once as an array with a row per frame, then replayed by index.
+Entries are keyed by the animation and everything its period is rendered from (colors, height, mode, LED
+count), and the least recently used ones are evicted once the cache grows past 'frame_cache_mb' from config.yaml.
+
+Periods are always rendered in the web server process, so cached periods survive mode switches: animations
+added before an engine starts are built there before the fork, and animations sent to a running or standby
+engine are built there first and the engine is sent the periods they replay, which it preloads into its own
+copy of the cache.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import config
+
+DEFAULT_CACHE_MB = 16
+
+
+class FrameCache:
+    def __init__(self, max_mb=None):
+        self._max_mb = max_mb
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._recorded = None  # {key: frames} of the periods looked up while recording
+
+    @property
+    def max_bytes(self):
+        max_mb = self._max_mb if self._max_mb is not None else config.setting('frame_cache_mb', DEFAULT_CACHE_MB)
+        return int(float(max_mb) * 1024 * 1024)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def period(self, key, render_period):
+        """Return the frames for one period of an animation, calling render_period() to build them
+        if they are not cached yet.  A key of None skips the cache. """
+        if key is not None and key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            frames = self._entries[key]
+        else:
+            frames = render_period()
+            self.misses += 1
+            if key is not None:
+                self._store(key, frames)
+
+        if self._recorded is not None and key is not None:
+            self._recorded[key] = frames
+        return frames
+
+    @contextmanager
+    def recording(self):
+        """Collects {key: frames} of every period looked up inside the with block, eg to send to an engine """
+        self._recorded = {}
+        try:
+            yield self._recorded
+        finally:
+            self._recorded = None
+
+    def preload(self, periods):
+        """Add periods rendered by another process, from recording() """
+        for key, frames in periods.items():
+            if key not in self._entries:
+                self._store(key, frames)
+
+    def _store(self, key, frames):
+        if frames.nbytes > self.max_bytes:
+            return
+        frames.setflags(write=False)  # Shared between every animation using this key
+        self._entries[key] = frames
+        self._bytes += frames.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def info(self):
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+frame_cache = FrameCache()
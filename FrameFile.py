@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Binary file of pre-rendered frames for every strand, as written by Renderer.py.
+
+The file starts with 'CURIOFRM', the length of a JSON header (strand names and LED counts, the mode, how
+long was rendered) and the header itself.  After that come fixed size records, one per frame: the frame's
+time in seconds as a float64, then the colors of every LED of each strand in turn, as the same little-endian
+packed 0xWWRRGGBB uint32s a FrameBuffer holds.  As every record is the same size, files can be memory mapped
+and read as one NumPy array, and a strand's frame copied straight into a FrameBuffer.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import json
+import struct
+import numpy as np
+
+MAGIC = b'CURIOFRM'
+VERSION = 2
+PREAMBLE = struct.Struct('<8sI')  # Magic, then header length
+
+
+def record_dtype(led_counts):
+    return np.dtype([('time', '<f8')] + [('strand_{}'.format(num), '<u4', (count,))
+                                         for num, count in enumerate(led_counts)])
+
+
+class FrameFileWriter:
+    def __init__(self, path, strands, info=None):
+        """strands is a list of (name, LED count), info anything else worth keeping in the header """
+        self._header = dict(info or {}, version=VERSION,
+                            strands=[{'name': name, 'leds': count} for name, count in strands])
+        self._dtype = record_dtype([count for _, count in strands])
+        self._record = np.zeros(1, dtype=self._dtype)
+        self.frames = 0
+
+        header = json.dumps(self._header).encode()
+        header += b' ' * (-(PREAMBLE.size + len(header)) % 8)  # Keep the records 8 byte aligned
+        self._file = open(path, 'wb')
+        self._file.write(PREAMBLE.pack(MAGIC, len(header)))
+        self._file.write(header)
+
+    def add(self, seconds, strips):
+        """Add the current pixels of each strip (FrameBuffers, in strand order) as the frame at 'seconds' """
+        self._record['time'] = seconds
+        for num, strip in enumerate(strips):
+            self._record['strand_{}'.format(num)] = strip.pixels
+        self._file.write(self._record.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FrameFile:
+    """Memory mapped frame file, frames are only read from disk as they are used """
+    def __init__(self, path):
+        with open(path, 'rb') as frame_file:
+            magic, header_length = PREAMBLE.unpack(frame_file.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a frame file".format(path))
+            self.header = json.loads(frame_file.read(header_length).decode())
+        if self.header.get('version') != VERSION:
+            raise ValueError("{} is version {} of the frame file format, expected {}".format(
+                path, self.header.get('version'), VERSION))
+
+        self.path = path
+        self.strands = self.header['strands']
+        dtype = record_dtype([strand['leds'] for strand in self.strands])
+        self.frames = np.memmap(path, dtype=dtype, mode='r', offset=PREAMBLE.size + header_length)
+        self.times = self.frames['time']
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self) else 0.0
+
+    def index_at(self, seconds):
+        """Index of the frame showing at 'seconds' into the file """
+        return max(0, int(np.searchsorted(self.times, seconds, side='right')) - 1)
+
+    def strand_frames(self, strand_num):
+        """Every frame of one strand, as a (frames, LEDs) array backed by the file """
+        return self.frames['strand_{}'.format(strand_num)]
+
+    def colors(self, index, strand_num):
+        """Packed colors of one strand in one frame, ready to write into a FrameBuffer """
+        return self.strand_frames(strand_num)[index]
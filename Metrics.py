@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Render loop metrics in the Prometheus text exposition format, served at /metrics.
+
+Animation processes record durations into SharedHistograms, which are plain shared memory arrays written
+by the animation loop without locks and read by the web server whenever /metrics is scraped, so collecting
+them never blocks a frame.  A scrape may see a histogram part way through an update, which is at worst one
+observation out.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import bisect
+import multiprocessing
+
+# Upper bounds (in seconds) of the duration histogram buckets, the last bucket is +Inf
+DURATION_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1]
+TRANSITION_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10]  # For whole transitions between modes
+
+
+class SharedHistogram:
+    """Rows of duration histograms in shared memory, eg one row per animation slot """
+    def __init__(self, rows, buckets=DURATION_BUCKETS):
+        self._bounds = list(buckets)
+        self._width = len(self._bounds) + 3  # A count per bucket, then +Inf, the observation count and their sum
+        self._values = multiprocessing.RawArray('d', rows * self._width)
+
+    def observe(self, row, seconds):
+        start = row * self._width
+        self._values[start + bisect.bisect_left(self._bounds, seconds)] += 1
+        self._values[start + self._width - 2] += 1
+        self._values[start + self._width - 1] += seconds
+
+    def clear(self, row):
+        start = row * self._width
+        self._values[start:start + self._width] = [0.0] * self._width
+
+    def snapshot(self, row):
+        """Cumulative count of each bucket (including +Inf), the observation count and their sum """
+        start = row * self._width
+        values = self._values[start:start + self._width]
+        cumulative = []
+        total = 0
+        for count in values[:-2]:
+            total += count
+            cumulative.append(total)
+        return cumulative, values[-2], values[-1]
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+
+def merge_snapshots(snapshots):
+    """Add up snapshots of the same histogram from several processes """
+    snapshots = list(snapshots)
+    if not snapshots:
+        return None
+    buckets = [sum(counts) for counts in zip(*[snapshot[0] for snapshot in snapshots])]
+    return buckets, sum(snapshot[1] for snapshot in snapshots), sum(snapshot[2] for snapshot in snapshots)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsText:
+    """Builds a page of metrics, each declared once with its help and type before its samples """
+    def __init__(self):
+        self._families = {}  # name -> (type, help, sample lines), kept in the order they were declared
+
+    def declare(self, name, metric_type, help_text):
+        if name not in self._families:
+            self._families[name] = (metric_type, help_text, [])
+
+    def sample(self, name, value, labels=None, suffix=''):
+        self._families[name][2].append('{}{}{} {}'.format(name, suffix, _format_labels(labels), _format_value(value)))
+
+    def histogram(self, name, snapshot, bounds, labels=None):
+        buckets, count, total = snapshot
+        labels = labels or {}
+        for bound, bucket_count in zip(bounds + [float('inf')], buckets):
+            self.sample(name, bucket_count, dict(labels, le=_format_value(bound)), '_bucket')
+        self.sample(name, total, labels, '_sum')
+        self.sample(name, count, labels, '_count')
+
+    def text(self):
+        lines = []
+        for name, (metric_type, help_text, samples) in self._families.items():
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+The strands section of config.yaml compiled into one table per mode.
+
+Every range and individual id of each strand is read once into a StrandEntry (its name, LED ids and the
+animation text for each mode), and each mode then gets a ModeTable with:
+  - the static colors of every strand as a packed color array, and which LEDs the mode sets
+  - the animations to run, with the LED ids they cover
+  - the per-LED name and animation text shown by /state
+so switching mode is a table lookup and one bulk write per strand.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+from collections import namedtuple
+import numpy as np
+import config
+import ConfigCache
+from FrameBuffer import colors_from_list_with_range, random_generator
+from includes import find_ids, parse_animation_text
+
+# A range or individual id of a strand - its name, LED ids (as an index array) and {mode: animation text}
+StrandEntry = namedtuple('StrandEntry', ['name', 'ids', 'animations'])
+
+
+def strand_entries(strand_name, strand_config, size):
+    """Ranges then individual ids of one strand, in the order they are applied """
+    entries = []
+    id_ranges_data = strand_config.get('id_ranges') or {}
+    for range_name, range_data in id_ranges_data.items():
+        ids = find_ids(range_data.get('ids', ""), range_data.get('id_start', ""), range_data.get('id_end', ""),
+                       limit_to=size)
+        entries.append(StrandEntry(range_name, ids, range_data.get('animations') or {}))
+
+    ids_data = strand_config.get('ids') or {}
+    for led, id_data in ids_data.items():
+        entries.append(StrandEntry(id_data.get('name', ''), [int(led)], id_data.get('animations') or {}))
+
+    checked = []
+    for entry in entries:
+        invalid = [led for led in entry.ids if not 0 <= led < size]
+        if invalid:
+            config.log.warning('Invalid led animation config: strand {} {} {}'.format(strand_name, entry.name,
+                                                                                      invalid))
+        checked.append(entry._replace(ids=np.array([led for led in entry.ids if 0 <= led < size], dtype=np.intp)))
+    return checked
+
+
+class ModeTable:
+    """Everything needed to show one mode """
+    def __init__(self, mode, strands):
+        self.mode = mode
+        self.colors = []  # Packed static colors of each strand
+        self.lit = []  # Ids of the LEDs on each strand that the mode sets, others keep what they were showing
+        self.animations = []  # {'range_name', 'leds', 'animation' (text), 'strip_id', 'entry'} of each animation
+        self.light_data = []  # Name and animation text of every LED of each strand, for /state
+        self.entries = [entries for entries, _ in strands]
+        self.texts = []  # Animation text of each entry of each strand, to compare modes by
+
+        for strip_id, (entries, size) in enumerate(strands):
+            colors = np.zeros(size, dtype=np.uint32)
+            lit = np.zeros(size, dtype=bool)
+            led_database = [{} for _ in range(size)]
+            texts = []
+            for entry_num, entry in enumerate(entries):
+                animation_text = entry.animations.get(mode, 'off')
+                texts.append(animation_text)
+                parsed_anim = parse_animation_text(animation_text)
+                colors[entry.ids] = colors_from_list_with_range(parsed_anim, len(entry.ids),
+                                                                random_generator(parsed_anim.get('seed')))
+                lit[entry.ids] = True
+                for led in entry.ids:
+                    led_database[led] = {'id': int(led), 'color': int(colors[led]), 'name': entry.name,
+                                         'anim_text': animation_text}
+
+                if mode in entry.animations and parsed_anim.get('animation'):
+                    self.animations.append({'range_name': entry.name, 'leds': entry.ids.tolist(),
+                                            'animation': animation_text, 'strip_id': strip_id,
+                                            'entry': (strip_id, entry_num)})
+            self.texts.append(texts)
+            self.colors.append(colors)
+            self.lit.append(np.flatnonzero(lit))
+            self.light_data.append(led_database)
+
+    def changed_entries(self, previous):
+        """(strip_id, entry number) of every range or id whose animation text differs from the previous table """
+        return [(strip_id, entry_num)
+                for strip_id, (texts, previous_texts) in enumerate(zip(self.texts, previous.texts))
+                for entry_num, (text, previous_text) in enumerate(zip(texts, previous_texts))
+                if text != previous_text]
+
+
+class ModeTables:
+    """Tables of every mode named in a strands config, compiled when created """
+    def __init__(self, strands_config, strand_sizes):
+        self.strand_names = list(strands_config.keys())
+        self.strand_sizes = list(strand_sizes)
+        self._strands = [(strand_entries(name, strands_config.get(name) or {}, size), size)
+                         for name, size in zip(self.strand_names, self.strand_sizes)]
+
+        self.modes = []  # Every mode named, in the order they first appear
+        for entries, _ in self._strands:
+            for entry in entries:
+                self.modes.extend(mode for mode in entry.animations if mode not in self.modes)
+        self._tables = {mode: ModeTable(mode, self._strands) for mode in self.modes}
+        self._all_off = ModeTable(None, self._strands)  # Shared by every mode no strand names
+
+    def table(self, mode):
+        """Table of a mode, a mode no strand names shows every configured LED off """
+        return self._tables.get(mode, self._all_off)
+
+
+_compiled = None  # (strands config, strand sizes, ModeTables) last compiled
+
+
+def mode_tables_for(strands_config, strand_sizes):
+    """Compiled tables of a strands config, only compiled again when given a different config.  The tables of
+    the strands in config.yaml are kept in the config cache, so a restart doesn't compile them again """
+    global _compiled
+    strand_sizes = list(strand_sizes)
+    if _compiled is None or _compiled[0] is not strands_config or _compiled[1] != strand_sizes:
+        from_config = strands_config is config.settings.get('strands')
+        tables = ConfigCache.compiled_tables(strand_sizes) if from_config else None
+        if tables is None:
+            tables = ModeTables(strands_config, strand_sizes)
+            if from_config and not ConfigCache.save_tables(tables):
+                config.log.warning('Could not write the config cache {}'.format(ConfigCache.CONFIG_CACHE_FILE))
+        _compiled = (strands_config, strand_sizes, tables)
+    return _compiled[2]
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Final step of every frame before it reaches the LEDs: gamma correction, brightness and color order.
+
+Gamma and brightness are folded into one 256 entry lookup table, and the color order is a byte
+permutation, so a whole frame is converted with a single table lookup over its bytes.  The strip
+itself is created with an identity color order and no brightness or gamma of its own, so colors
+are only ever scaled and reordered here.
+
+Set globally with 'brightness' and 'gamma' in config.yaml, and per strand with 'brightness', 'gamma'
+and 'color_order' (RGB, GRB, RGBW, GRBW, ...).  Brightness is 0..255, and both brightnesses apply.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import numpy as np
+import config
+
+DEFAULT_COLOR_ORDER = 'GRB'  # What rpi_ws281x strips use unless told otherwise
+COLOR_ORDERS = ['RGB', 'RBG', 'GRB', 'GBR', 'BRG', 'BGR', 'RGBW', 'GRBW', 'BRGW', 'WRGB']
+
+# Byte of a packed 0xWWRRGGBB color holding each channel (colors are little-endian uint32s)
+CHANNEL_BYTES = {'B': 0, 'G': 1, 'R': 2, 'W': 3}
+# Bytes the strip sends first, second, third and fourth when it has an identity (RGB/RGBW) strip type
+WIRE_BYTES = [2, 1, 0, 3]
+
+# rpi_ws281x strip types that send the packed bytes unchanged
+STRIP_TYPE_RGB = 0x00100800
+STRIP_TYPE_RGBW = 0x18100800
+
+
+class OutputStage:
+    def __init__(self, gamma=1.0, brightness=255, color_order=DEFAULT_COLOR_ORDER):
+        color_order = str(color_order).upper()
+        if color_order not in COLOR_ORDERS:
+            config.log.warning("Unknown color_order '{}', valid orders are {}".format(color_order, COLOR_ORDERS))
+            color_order = DEFAULT_COLOR_ORDER
+
+        self.gamma = float(gamma)
+        self.brightness = min(255, max(0, int(brightness)))
+        self.color_order = color_order
+
+        levels = np.arange(256) / 255
+        self._lut = np.round(255 * (levels ** self.gamma) * (self.brightness / 255)).astype(np.uint8)
+
+        # Which input byte ends up in each output byte
+        self._wire_bytes = WIRE_BYTES[:len(color_order)]
+        self._channel_bytes = [CHANNEL_BYTES[channel] for channel in color_order]
+        self._identity = self.gamma == 1 and self.brightness == 255 and color_order in ['RGB', 'RGBW']
+        self._out = np.zeros(0, dtype=np.uint32)
+
+    @property
+    def strip_type(self):
+        """The rpi_ws281x strip type to create the strip with, so it leaves the bytes alone """
+        return STRIP_TYPE_RGBW if 'W' in self.color_order else STRIP_TYPE_RGB
+
+    def apply(self, pixels):
+        """Return the frame the way the strip should be sent it.  The result is reused by the next call """
+        if self._identity:
+            return pixels
+        if len(self._out) != len(pixels):
+            self._out = np.zeros(len(pixels), dtype=np.uint32)
+
+        in_bytes = pixels.view(np.uint8).reshape(-1, 4)
+        out_bytes = self._out.view(np.uint8).reshape(-1, 4)
+        out_bytes[:, self._wire_bytes] = self._lut[in_bytes[:, self._channel_bytes]]
+        return self._out
+
+
+def output_stage_for(strand_config):
+    """Build the output stage of a strand from its config.yaml settings and the global ones """
+    strand_config = strand_config or {}
+    gamma = strand_config.get('gamma', config.settings.get('gamma', 1.0))
+    brightness = int(config.settings.get('brightness', 255)) * int(strand_config.get('brightness', 255)) // 255
+    return OutputStage(gamma, brightness, strand_config.get('color_order', DEFAULT_COLOR_ORDER))
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Keeps the current the LEDs draw inside the strand's and the power supply's budget.
+
+Right before a frame is sent, the draw is estimated from the sum of every channel byte that will be sent
+(each channel at full brightness draws 'milliamps_per_channel', and each LED draws 'idle_milliamps_per_led'
+even when dark).  If the frame is over budget, every channel is scaled down by the same amount.
+
+Strands share the supply: the estimated draw of every strand is kept in shared memory, and when all of them
+together are over 'power_supply_milliamps' each strand is cut back to its share of the supply when it next
+shows a frame.  Set in config.yaml, globally and per strand ('max_milliamps', 'milliamps_per_channel').
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import multiprocessing
+import numpy as np
+import config
+
+DEFAULT_MILLIAMPS_PER_CHANNEL = 20
+DEFAULT_IDLE_MILLIAMPS_PER_LED = 1
+
+
+class PowerLimiter:
+    def __init__(self, strand_num, draws, led_count, milliamps_per_channel=DEFAULT_MILLIAMPS_PER_CHANNEL,
+                 idle_milliamps_per_led=DEFAULT_IDLE_MILLIAMPS_PER_LED, max_milliamps=None, supply_milliamps=None):
+        self._strand_num = strand_num
+        self._draws = draws  # Shared by every strand - requested then estimated milliamps of each strand
+        self._idle_milliamps = float(idle_milliamps_per_led) * led_count
+        self.milliamps_per_channel = float(milliamps_per_channel)
+        self.max_milliamps = float(max_milliamps) if max_milliamps else None
+        self.supply_milliamps = float(supply_milliamps) if supply_milliamps else None
+
+    def estimate(self, pixels):
+        """Milliamps the strip will draw showing these (output-ready) pixels """
+        channel_total = int(pixels.view(np.uint8).sum(dtype=np.uint64))
+        return self._idle_milliamps + channel_total * self.milliamps_per_channel / 255
+
+    def limit(self, pixels):
+        """Return the pixels, scaled down uniformly if they would draw more than the budget allows """
+        requested = self.estimate(pixels)
+        self._draws[2 * self._strand_num] = requested
+
+        budget = requested
+        if self.max_milliamps:
+            budget = min(budget, self.max_milliamps)
+        if self.supply_milliamps:
+            total_requested = sum(self._draws[0::2])
+            if total_requested > self.supply_milliamps:
+                budget = min(budget, requested * self.supply_milliamps / total_requested)
+
+        if budget < requested:
+            # Only the lit channels can be cut back, the idle draw stays however small the budget is.  A dark
+            # strand has nothing to cut, so it is sent as it is
+            lit_milliamps = requested - self._idle_milliamps
+            if lit_milliamps > 0:
+                scale = (max(budget, self._idle_milliamps) - self._idle_milliamps) / lit_milliamps
+                pixels = (pixels.view(np.uint8) * scale).astype(np.uint8).view(np.uint32)
+            budget = self.estimate(pixels)
+        self._draws[2 * self._strand_num + 1] = budget
+        return pixels
+
+    def info(self):
+        """Estimated draw of this strand, readable from any process """
+        return {'requested_milliamps': round(self._draws[2 * self._strand_num], 1),
+                'estimated_milliamps': round(self._draws[2 * self._strand_num + 1], 1),
+                'max_milliamps': self.max_milliamps}
+
+
+def power_limiters_for(strands_config):
+    """Build a limiter for each strand, all sharing the power supply """
+    strands_config = strands_config or {}
+    draws = multiprocessing.RawArray('d', 2 * len(strands_config))
+    limiters = []
+    for strand_num, strand_name in enumerate(strands_config):
+        strand = strands_config[strand_name]
+        limiters.append(PowerLimiter(
+            strand_num, draws, strand['size'],
+            strand.get('milliamps_per_channel', config.settings.get('milliamps_per_channel',
+                                                                     DEFAULT_MILLIAMPS_PER_CHANNEL)),
+            config.settings.get('idle_milliamps_per_led', DEFAULT_IDLE_MILLIAMPS_PER_LED),
+            strand.get('max_milliamps'),
+            config.settings.get('power_supply_milliamps')))
+    return limiters
+
+
+def supply_info(limiters):
+    """Estimated draw of all strands together, against the power supply limit """
+    return {'requested_milliamps': round(sum(limiter.info()['requested_milliamps'] for limiter in limiters), 1),
+            'estimated_milliamps': round(sum(limiter.info()['estimated_milliamps'] for limiter in limiters), 1),
+            'supply_milliamps': limiters[0].supply_milliamps if limiters else None}
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+On-demand profiling of a running animation engine, started by the 'profile' engine command (from /profile or
+the MQTT 'profile' message) and stopped by itself after the requested number of seconds.
+
+Two kinds of profile can be taken:
+  stats  - cProfile of the animation loop, written as stats sorted by cumulative time (and a .prof file for
+           tools like snakeviz).  Counts every call, so slows the loop down while it runs.
+  stacks - samples the animation loop's stack every few milliseconds from a background thread, written as
+           collapsed stacks ('outer;inner;innermost count' lines) for flamegraph.pl or speedscope.
+
+Nothing is hooked into the engine until a profile is requested, so it costs nothing when not in use.
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import cProfile
+import collections
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_MODES = ['stats', 'stacks']
+PROFILE_SORTS = [key.value for key in pstats.SortKey]
+SAMPLE_INTERVAL_SECONDS = 0.002
+STATS_LINES = 60
+
+
+def profile_paths(folder, name, mode):
+    """Files a profile will be written to - the readable result first """
+    base = os.path.join(folder, '{}-{}'.format(name, time.strftime('%Y%m%d-%H%M%S')))
+    if mode == 'stacks':
+        return [base + '.collapsed']
+    return [base + '.txt', base + '.prof']
+
+
+def write_atomically(path, text):
+    # The web server waits for the file to appear, so it should only appear once it is complete
+    with open(path + '.tmp', 'w') as profile_file:
+        profile_file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def collapse_stack(frame):
+    """One sampled stack as 'outermost;...;innermost' of file:function names """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class EngineProfiler:
+    """Profiles the thread that starts it (the animation loop) for a number of seconds """
+    def __init__(self, seconds, mode, paths, sort='cumulative', clock=time.monotonic):
+        self._clock = clock
+        self._ends = clock() + seconds
+        self._mode = mode
+        self._paths = paths
+        self._sort = sort
+        self._profile = None
+        self._sampler = None
+        self._samples = collections.Counter()
+        self._done = threading.Event()
+
+        os.makedirs(os.path.dirname(os.path.abspath(paths[0])), exist_ok=True)
+        if mode == 'stacks':
+            self._thread_id = threading.get_ident()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @property
+    def paths(self):
+        return self._paths
+
+    def seconds_left(self):
+        return max(0.0, self._ends - self._clock())
+
+    def finished(self):
+        return self._done.is_set()
+
+    def check(self):
+        """Called by the animation loop, writes the profile once its time is up.  Returns True when done """
+        if self._profile is not None and not self._done.is_set() and self.seconds_left() <= 0:
+            self._profile.disable()
+            self._profile.dump_stats(self._paths[1])
+            stats_text = io.StringIO()
+            pstats.Stats(self._profile, stream=stats_text).sort_stats(self._sort).print_stats(STATS_LINES)
+            write_atomically(self._paths[0], stats_text.getvalue())
+            self._done.set()
+        return self._done.is_set()
+
+    def _sample(self):
+        while self.seconds_left() > 0:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._samples[collapse_stack(frame)] += 1
+            time.sleep(SAMPLE_INTERVAL_SECONDS)
+
+        write_atomically(self._paths[0], ''.join('{} {}\n'.format(stack, count)
+                                                 for stack, count in self._samples.most_common()))
+        self._done.set()
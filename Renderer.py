@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Render a mode from config.yaml to a frame file without any lights, faster than real time.
+
+The mode is set up with setup_lights_from_configuration on stub strips, and its animations are run by an
+AnimationProcess in this process on a simulated clock, which jumps straight to each frame's deadline instead
+of sleeping.  Every frame is written to a FrameFile, for previews, repeatable performance tests or shows
+played back later.
+
+    python3 Renderer.py combat --seconds 60 --output combat.frames
+"""
+__author___ = "Jay Crossler"
+__status__ = "Development"
+
+import argparse
+import time
+import config
+import functions
+import AnimationProcess
+from FrameBuffer import FrameBuffer
+from FrameFile import FrameFileWriter
+from rpi_fake import PixelStrip
+
+
+class SimulatedClock:
+    """Stands in for time.monotonic, only moving when advanced """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def render_mode(mode, seconds, path, strands_config=None):
+    """Render 'seconds' of a mode into a frame file at path.  Returns how many frames were written """
+    strands_config = strands_config or config.settings['strands']
+    config.light_strips = [FrameBuffer(PixelStrip(strand['size'], strand.get('pin', 18)))
+                           for strand in strands_config.values()]
+    config.current_mode = mode
+
+    animation_list = []
+    config.light_data = functions.setup_lights_from_configuration(strands_config,
+                                                                  animation_starter=animation_list.extend)
+
+    engine = AnimationProcess.AnimationProcess()
+    for anim in animation_list:
+        engine.add_animation(functions.animation_data_for(anim))
+
+    clock = SimulatedClock()
+    engine.start_on_clock(clock)
+    strands = [(name, strand['size']) for name, strand in strands_config.items()]
+    with FrameFileWriter(path, strands, {'mode': mode, 'seconds': seconds}) as frame_file:
+        frame_file.add(0.0, config.light_strips)  # The static colors, before any animation frame
+        while True:
+            wait = engine.seconds_until_next_frame()
+            if wait is None or clock.now + wait > seconds:
+                break
+            clock.advance(wait)
+            if engine.render_due_frames():
+                frame_file.add(clock.now, config.light_strips)
+        return frame_file.frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a mode from config.yaml to a frame file')
+    parser.add_argument('mode', help='Mode to render, eg default')
+    parser.add_argument('--seconds', type=float, default=10, help='Seconds of animation to render')
+    parser.add_argument('--output', default=None, help='Frame file to write (default <mode>.frames)')
+    args = parser.parse_args()
+
+    config.initialize('Renderer')
+    output = args.output or '{}.frames'.format(args.mode)
+    started = time.monotonic()
+    frames = render_mode(args.mode, args.seconds, output)
+    elapsed = time.monotonic() - started
+    print("Rendered {} frames covering {}s of '{}' in {:.2f}s ({:.0f}x real time) to {}".format(
+        frames, args.seconds, args.mode, elapsed, args.seconds / elapsed if elapsed else 0, output))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,9 @@ Long-running processes are tracked in a queue, and should be stopped both by kil
 and from within the process.
 
 """
+import time
+started = time.monotonic()  # Before the slower imports, so the time to first light includes them
+
 from flask import Flask
 from flask_mqtt import Mqtt
 # from flask_debugtoolbar import DebugToolbarExtension
@@ -20,7 +23,7 @@ __author___ = "Jay Crossler"
 __status__ = "Development"
 app_name = "Curio LED Manager"
 
-# TODO: Find why rainbow is running slow and configuration isn't updating - will processes work as planned?
+# TODO: Find why configuration isn't updating - will processes work as planned?
 # TODO: Decide if we need to change the LED library?
 # TODO: Verify if the config.light_color_data is working.  Is there a better way to track strip color info?
 
@@ -103,6 +106,14 @@ def initialize_config_and_app():
     import routes  # This is a bit of a hack, just breaks the main page up into multiple pages
 
 
+def report_first_light():
+    """Log how long after starting the lights came on, and whether the config cache was used """
+    config.startup['first_light_seconds'] = time.monotonic() - started
+    config.log.info('First light {:.0f}ms after starting (config cache {}, config loaded in {:.1f}ms)'.format(
+        config.startup['first_light_seconds'] * 1000, config.startup.get('config_cache'),
+        config.startup.get('config_seconds', 0) * 1000))
+
+
 # Initial application launcher
 def start_flask_app():
     try:
@@ -129,4 +140,5 @@ if __name__ == '__main__':
     initialize_config_and_app()
     initialize_lighting()
     config.light_data = setup_lights_from_configuration()
+    report_first_light()
     start_flask_app()
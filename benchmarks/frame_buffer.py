@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compare per-frame cost of writing pixels one at a time with setPixelColor() against
+writing them into a FrameBuffer and bulk-copying it to the strip.
+
+Run from the project folder:  python3 benchmarks/frame_buffer.py
+"""
+import os
+import sys
+import timeit
+from math import sin, pi
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from includes import Color, blend_colors  # noqa: E402
+from rpi_fake import PixelStrip  # noqa: E402
+from FrameBuffer import FrameBuffer  # noqa: E402
+import AnimationFrames  # noqa: E402
+
+LED_COUNTS = [150, 1000, 10000]
+FRAMES = 50
+
+
+def legacy_pulse(strip, count):
+    color = blend_colors(Color(0, 0, 0), Color(255, 255, 255), .5)
+    for i in range(count):
+        strip.setPixelColor(i, color)
+    strip.show()
+
+
+def legacy_warp(strip, count):
+    for i in range(count):
+        x_range = (i + .5) / (count + 1)
+        amplitude_of_point = .5 * (sin((2 * pi * x_range) - (.5 * pi)) + 1)
+        strip.setPixelColor(i, blend_colors(Color(0, 0, 255), Color(255, 255, 255), amplitude_of_point * .5))
+    strip.show()
+
+
+def time_per_frame(func):
+    return min(timeit.repeat(func, number=FRAMES, repeat=3)) / FRAMES
+
+
+def main():
+    print("{:>6}  {:<8} {:>14} {:>14} {:>9}".format('LEDs', 'frame', 'per-pixel (us)', 'buffer (us)', 'speedup'))
+    for count in LED_COUNTS:
+        strip = PixelStrip(count, 18)
+        buffer = FrameBuffer(PixelStrip(count, 18))
+
+        animation_config = {'color_list': [Color(0, 0, 255), Color(255, 255, 255)], 'loop_speed': 3}
+        pulse = AnimationFrames.PulseFrame(buffer, 0, list(range(count)), dict(animation_config))
+        warp = AnimationFrames.WarpFrame(buffer, 0, list(range(count)), dict(animation_config))
+
+        cases = [('pulse', lambda: legacy_pulse(strip, count), lambda: (pulse.next(), buffer.show())),
+                 ('warp', lambda: legacy_warp(strip, count), lambda: (warp.next(), buffer.show()))]
+
+        for name, legacy, buffered in cases:
+            legacy_time = time_per_frame(legacy)
+            buffered_time = time_per_frame(buffered)
+            print("{:>6}  {:<8} {:>14.1f} {:>14.1f} {:>8.1f}x".format(
+                count, name, legacy_time * 1e6, buffered_time * 1e6, legacy_time / buffered_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Cost of one frame of every animation, for the frame classes in AnimationFrames.py and the legacy loops in
+animations.py, at a range of LED counts on the stub strip.
+
+For each animation and LED count it reports the median time per frame, the most frames per second that
+could be sustained, and the bytes allocated while rendering a frame.  Results are written as JSON (tagged
+with the git commit) so runs can be compared across commits.
+
+Run from the project folder:
+    python3 benchmarks/frame_kernels.py
+    python3 benchmarks/frame_kernels.py --leds 150 --output before.json
+    python3 benchmarks/frame_kernels.py --leds 150 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np  # noqa: E402
+import AnimationFrames  # noqa: E402
+import animations  # noqa: E402
+from FrameBuffer import FrameBuffer  # noqa: E402
+from FrameCache import frame_cache  # noqa: E402
+from includes import parse_animation_text  # noqa: E402
+from rpi_fake import PixelStrip  # noqa: E402
+
+LED_COUNTS = [20, 150, 1000, 10000]
+TIME_BUDGET_SECONDS = 0.5  # Spent timing each animation at each LED count
+MIN_FRAMES = 5
+MAX_FRAMES = 500
+ALLOCATION_FRAMES = 5
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# name, animation text, frame class, legacy loop
+KERNELS = [
+    ('rainbow', 'red, rainbow, fast', AnimationFrames.RainbowFrame, animations.rainbow_cycle),
+    ('warp', 'blue and white, warp, fast', AnimationFrames.WarpFrame, animations.warp_cycle),
+    ('twinkle', 'white and yellow, twinkle, fast', AnimationFrames.TwinkleFrame, animations.twinkle_cycle),
+    ('pulsing', 'black and red, pulsing, fast', AnimationFrames.PulseFrame, animations.pulse_cycle),
+    ('blinking', 'red and blue, blinking, fast', AnimationFrames.BlinkFrame, animations.blink_cycle),
+    ('blinkenlicht', 'black and orange, blinkenlicht, fast', AnimationFrames.BlinkenlichtFrame,
+     animations.blinkenlicht_cycle),
+]
+
+
+class EnoughFrames(Exception):
+    pass
+
+
+class FrameTimer:
+    """Called at the end of every frame, records how long it took and how much it allocated """
+    def __init__(self, max_frames=MAX_FRAMES, budget=TIME_BUDGET_SECONDS, track_allocations=False):
+        self._max_frames = max_frames
+        self._budget_ns = budget * 1e9
+        self._track_allocations = track_allocations
+        self._started = None
+        self._last = None
+        self.frame_ns = []
+        self.allocated = []
+
+    def start(self):
+        if self._track_allocations:
+            tracemalloc.start()
+        self._started = self._last = time.perf_counter_ns()
+
+    def tick(self):
+        """Returns False once enough frames have been timed """
+        now = time.perf_counter_ns()
+        if self._started is None:
+            # The first frame of a legacy loop marks the end of its setup
+            self.start()
+            return True
+
+        self.frame_ns.append(now - self._last)
+        if self._track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocated.append(peak - current)
+            tracemalloc.reset_peak()
+
+        done = len(self.frame_ns) >= self._max_frames or (
+            len(self.frame_ns) >= MIN_FRAMES and now - self._started >= self._budget_ns)
+        if done and self._track_allocations:
+            tracemalloc.stop()
+        self._last = time.perf_counter_ns()
+        return not done
+
+
+class TimedStrip(PixelStrip):
+    """Stub strip that ends a legacy animation loop once its FrameTimer has seen enough frames """
+    def __init__(self, num, timer):
+        super(TimedStrip, self).__init__(num, 18)
+        self._timer = timer
+
+    def show(self):
+        if not self._timer.tick():
+            raise EnoughFrames()
+
+
+def run_frames(frame_class, text, count, timer):
+    frame_cache.clear()
+    buffer = FrameBuffer(PixelStrip(count, 18))
+    frame = frame_class(buffer, 0, list(range(count)), parse_animation_text(text))
+    timer.start()
+    while True:
+        frame.next()
+        buffer.show()
+        if not timer.tick():
+            return
+
+
+def run_legacy(loop, text, count, timer):
+    strip = TimedStrip(count, timer)
+    try:
+        loop(strip, anim_config=parse_animation_text(text), id_list=list(range(count)))
+    except EnoughFrames:
+        pass
+
+
+def measure(runner, kernel, text, count):
+    timer = FrameTimer()
+    runner(kernel, text, count, timer)
+    allocations = FrameTimer(max_frames=ALLOCATION_FRAMES, track_allocations=True)
+    runner(kernel, text, count, allocations)
+
+    ns_per_frame = statistics.median(timer.frame_ns)
+    return {'ns_per_frame': int(ns_per_frame),
+            'max_fps': round(1e9 / ns_per_frame, 1) if ns_per_frame else None,
+            'alloc_bytes_per_frame': int(statistics.median(allocations.allocated)),
+            'frames': len(timer.frame_ns)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    before = {(r['kernel'], r['engine'], r['leds']): r for r in previous['results']}
+    print("\nCompared to commit {}:".format(previous.get('commit')))
+    print("{:<14} {:<7} {:>6} {:>14} {:>14} {:>8}".format('kernel', 'engine', 'LEDs', 'before (us)', 'now (us)',
+                                                          'change'))
+    for result in results:
+        old = before.get((result['kernel'], result['engine'], result['leds']))
+        if old:
+            print("{:<14} {:<7} {:>6} {:>14.1f} {:>14.1f} {:>+7.0f}%".format(
+                result['kernel'], result['engine'], result['leds'], old['ns_per_frame'] / 1000,
+                result['ns_per_frame'] / 1000, 100 * (result['ns_per_frame'] / old['ns_per_frame'] - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--leds', default=",".join(map(str, LED_COUNTS)), help='LED counts, eg 20,150')
+    parser.add_argument('--kernels', default=None, help='Animations to run, eg rainbow,twinkle (default all)')
+    parser.add_argument('--no-legacy', action='store_true', help="Don't run the legacy animations.py loops")
+    parser.add_argument('--output', default=None, help='Where to write the JSON results')
+    parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    # The legacy loops sleep between frames, which isn't part of their cost
+    animations.time = types.SimpleNamespace(sleep=lambda seconds: None)
+
+    led_counts = [int(count) for count in args.leds.split(',')]
+    kernels = [k for k in KERNELS if not args.kernels or k[0] in args.kernels.split(',')]
+    engines = ['frames'] + ([] if args.no_legacy else ['legacy'])
+
+    results = []
+    print("{:<14} {:<7} {:>6} {:>12} {:>10} {:>14}".format('kernel', 'engine', 'LEDs', 'us/frame', 'max fps',
+                                                           'alloc B/frame'))
+    for name, text, frame_class, legacy_loop in kernels:
+        for count in led_counts:
+            for engine in engines:
+                if engine == 'frames':
+                    measured = measure(run_frames, frame_class, text, count)
+                else:
+                    measured = measure(run_legacy, legacy_loop, text, count)
+                result = dict(kernel=name, engine=engine, leds=count, **measured)
+                results.append(result)
+                print("{:<14} {:<7} {:>6} {:>12.1f} {:>10.1f} {:>14}".format(
+                    name, engine, count, result['ns_per_frame'] / 1000, result['max_fps'],
+                    result['alloc_bytes_per_frame']))
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_FOLDER, 'frame_kernels-{}.json'.format(commit or 'unknown'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump({'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+                   'machine': platform.machine(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': results}, results_file, indent=2)
+    print("\nResults written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(results, json.load(previous_file))
+
+
+if __name__ == '__main__':
+    main()
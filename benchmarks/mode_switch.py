@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Measure how long a mode switch takes, from the request until the first frame of the new mode's
+animations: restarting every animation (with and without a prewarmed standby engine), and switching
+incrementally, which only restarts the ranges that change.
+
+Uses a made-up ship of two strands rather than config.yaml, so results compare between machines.
+
+Run from the project folder:  python3 benchmarks/mode_switch.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config  # noqa: E402
+import functions  # noqa: E402
+
+SWITCHES = 20
+FIRST_FRAME_TIMEOUT = 5
+
+STRANDS = {
+    'engines': {'size': 150, 'pin': 18, 'id_ranges': {
+        'left': {'id_start': 0, 'id_end': 75, 'animations': {
+            'cruise': 'blue and white, warp', 'combat': 'red, pulsing, fast'}},
+        'right': {'id_start': 75, 'id_end': 150, 'animations': {
+            'cruise': 'blue, pulsing', 'combat': 'red and orange, blinking'}}}},
+    'cabin': {'size': 60, 'pin': 13, 'id_ranges': {
+        'lights': {'id_start': 0, 'id_end': 60, 'animations': {
+            'cruise': 'white and yellow, twinkle', 'combat': 'red, rainbow'}}}},
+}
+
+
+def first_frame_time():
+    # Each worker records when it showed its first frame, the switch is done when they all have
+    deadline = time.monotonic() + FIRST_FRAME_TIMEOUT
+    workers = [p['process'] for p in functions.running_processes]
+    while time.monotonic() < deadline:
+        first_frames = [worker.first_frame_time() for worker in workers]
+        if all(first_frames):
+            return max(first_frames)
+        time.sleep(0.001)
+    return None
+
+
+def next_frame_time(frames_before):
+    # An incremental switch keeps its engine, the switch is done when it has rendered another frame
+    deadline = time.monotonic() + FIRST_FRAME_TIMEOUT
+    while time.monotonic() < deadline:
+        if engine_frames() > frames_before:
+            return time.monotonic()
+        time.sleep(0.001)
+    return None
+
+
+def engine_frames():
+    return sum(p['process'].timing()['frames'] for p in functions.running_processes if p['process'].is_alive())
+
+
+def switch_latencies(standby, incremental=False):
+    config.settings['standby_engines'] = standby
+    config.settings['incremental_mode_switch'] = incremental
+    latencies = []
+    for switch in range(SWITCHES):
+        config.current_mode = 'combat' if switch % 2 else 'cruise'
+        frames_before = engine_frames()
+        started = time.monotonic()
+        functions.setup_lights_from_configuration(STRANDS)
+        requested = time.monotonic()
+        if functions.last_mode_switch.get('incremental'):
+            first_frame = next_frame_time(frames_before)
+        else:
+            first_frame = first_frame_time()
+        if first_frame is None:
+            print("No first frame after {}s".format(FIRST_FRAME_TIMEOUT))
+            continue
+        latencies.append((requested - started, first_frame - started))
+    functions.stop_everything()
+    while functions.standby_engines:
+        functions.end_process(functions.standby_engines.pop())
+    return latencies
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    config.settings['strands'] = STRANDS
+    functions.initialize_lighting()
+
+    print("{:<12} {:>16} {:>16} {:>16} {:>16}".format(
+        'engine', 'request p50 (ms)', 'first frame p50', 'first frame p95', 'first frame max'))
+    for name, standby, incremental in [('cold', False, False), ('standby', True, False),
+                                       ('incremental', False, True)]:
+        latencies = switch_latencies(standby, incremental)[1:]  # The first switch has no standby waiting yet
+        request_times = [request * 1000 for request, _ in latencies]
+        first_frames = [first_frame * 1000 for _, first_frame in latencies]
+        print("{:<12} {:>16.1f} {:>16.1f} {:>16.1f} {:>16.1f}".format(
+            name, percentile(request_times, 50), percentile(first_frames, 50), percentile(first_frames, 95),
+            max(first_frames)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import os
+import time
 import logger
-from yaml import safe_load
+import ConfigCache
 from includes import merge_dictionaries
 
 # Configuration Variables that are accessed by other scripts
@@ -11,8 +12,11 @@ current_mode = 'default'
 settings = {}
 mqtt_initialized = False
 mqtt_working = False
+startup = {}  # How the config was loaded and how long after starting the lights first came on, for /state
 log = logger.get_logger('App')
 
+CONFIG_FILES = ['config.yaml', 'secrets.yaml']  # Read in order, a setting in an earlier file wins
+
 
 def initialize(app_name):
     global log, settings
@@ -22,19 +26,23 @@ def initialize(app_name):
         # If logs directory doesn't exist, create it
         os.makedirs('logs')
 
-    filename = 'config.yaml'
-    if os.path.exists(filename):
-        with open(filename, 'r') as conf_file:
-            _yaml_contents = safe_load(conf_file)
-            settings = merge_dictionaries(settings, _yaml_contents)
-            log.info("Settings loaded")
-
-    filename = 'secrets.yaml'
-    if os.path.exists(filename):
-        with open(filename, 'r') as conf_file:
-            _yaml_secrets = safe_load(conf_file)
-            settings = merge_dictionaries(settings, _yaml_secrets)
-            log.info("Secrets loaded")
+    load_start = time.monotonic()
+    cached_settings = ConfigCache.load(CONFIG_FILES)
+    if cached_settings is not None:
+        settings = merge_dictionaries(settings, cached_settings)
+        log.info("Settings and secrets loaded from {}".format(ConfigCache.CONFIG_CACHE_FILE))
+    else:
+        file_settings = {}
+        for filename in CONFIG_FILES:
+            if os.path.exists(filename):
+                with open(filename, 'r') as conf_file:
+                    file_settings = merge_dictionaries(file_settings, ConfigCache.yaml_load(conf_file))
+                    log.info("{} loaded".format('Secrets' if filename == 'secrets.yaml' else 'Settings'))
+        if not ConfigCache.save_settings(file_settings):
+            log.warning("Could not update the config cache {}".format(ConfigCache.CONFIG_CACHE_FILE))
+        settings = merge_dictionaries(settings, file_settings)
+    startup['config_cache'] = 'hit' if cached_settings is not None else 'miss'
+    startup['config_seconds'] = time.monotonic() - load_start
 
     if 'strands' not in settings:
         settings['strands'] = []
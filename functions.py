@@ -9,9 +9,20 @@ built upon: https://github.com/rpi-ws281x/rpi-ws281x-python/blob/master/examples
 __author___ = "Jay Crossler"
 __status__ = "Development"
 
+import os
 import platform
+import threading
+import time
+import numpy as np
 from animations import *
 import AnimationProcess
+from FrameBuffer import FrameBuffer
+from Metrics import MetricsText, merge_snapshots, TRANSITION_BUCKETS
+from ModeTables import mode_tables_for
+from Compositor import TRANSITIONS
+import Profiler
+from OutputStage import output_stage_for
+from PowerLimiter import power_limiters_for
 
 from multiprocessing import Process
 from datetime import datetime
@@ -20,14 +31,23 @@ if platform.system() == 'Darwin':
     # This library doesn't import on Macintosh computers, ignore it and use a stub
     from rpi_fake import PixelStrip, Color
 else:
-    from rpi_ws281x import PixelStrip, Color
+    try:
+        from rpi_ws281x import PixelStrip, Color
+    except ImportError:
+        # Not running on a Pi (eg benchmarks or headless rendering), use the stub as well
+        from rpi_fake import PixelStrip, Color
 
 running_processes = []  # Database of running processes
+standby_engines = []  # Animation processes started ahead of time, waiting to take over at the next mode switch
+engine_lock = threading.Lock()  # Web and MQTT requests change the running animations one at a time
+shown_mode = None  # (ModeTables, ModeTable) the lights were last set up from, so the next switch can only change the
+#                    ranges that differ.  Cleared whenever something else takes over the lights
+last_mode_switch = {}  # What the last mode switch changed, for /state
 use_processes = True  # Set to False for testing processes, but messes up animations
 
 LED_FREQ_HZ = 800000  # LED signal frequency in hertz (usually 800khz)
 LED_DMA = 10          # DMA channel to use for generating signal (try 10)
-LED_BRIGHTNESS = 255  # Set to 0 for darkest and 255 for brightest
+LED_BRIGHTNESS = 255  # Library brightness, leave at 255 - use 'brightness' in config.yaml instead
 LED_INVERT = False    # True to invert the signal (when using NPN transistor level shift)
 LED_CHANNEL = 0       # set to '1' for GPIOs 13, 19, 41, 45 or 53
 
@@ -37,16 +57,21 @@ stop_flag = False
 
 def initialize_lighting():
 
-    # Build Strip objects for multiple strands
-    for i in config.setting('strands'):
+    # Build Strip objects for multiple strands, all sharing one power supply
+    power_limiters = power_limiters_for(config.setting('strands'))
+    for strand_num, i in enumerate(config.setting('strands')):
         strip = config.setting('strands')[i]
         led_count = strip['size']
         pin = strip['pin']
         config.log.info("Added light strip {} on pin {} size {}".format(i, pin, led_count))
-        light_strip = PixelStrip(led_count, pin, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+        # Gamma, brightness and color order are applied by the frame buffer's output stage, not the library
+        output = output_stage_for(strip)
+        light_strip = PixelStrip(led_count, pin, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL,
+                                 output.strip_type)
         # Initialize the library (must be called once before other functions).
         light_strip.begin()
-        config.light_strips.append(light_strip)
+        # Animations draw into a NumPy frame buffer that is bulk-copied to the strip on show()
+        config.light_strips.append(FrameBuffer(light_strip, output, power_limiters[strand_num]))
 
 
 def get_status():
@@ -63,8 +88,9 @@ def set_status(state):
 
 
 def func_color(r, g, b):
-    global stop_flag
+    global stop_flag, shown_mode
     stop_flag = True
+    shown_mode = None
     set_status("Wipe: {}, {}, {}".format(r, g, b))
     for light_strip in config.light_strips:
         color_wipe(light_strip, Color(r, g, b))
@@ -72,8 +98,9 @@ def func_color(r, g, b):
 
 
 def func_clear():
-    global stop_flag
+    global stop_flag, shown_mode
     stop_flag = True
+    shown_mode = None
     set_status("Clearing all lights")
     for light_strip in config.light_strips:
         clear(light_strip)
@@ -99,148 +126,238 @@ def reset_strip(strip):
 
 def clear(strip):
     """Clear all pixels."""
-    for i in range(strip.numPixels()):
-        strip.setPixelColor(i, Color(0, 0, 0))
+    strip.write(strip.index(), Color(0, 0, 0))
     strip.show()
 
 
-def setup_lights_from_configuration(strands_config=None, set_lights_on=True):
-    # Expects that light strips have been configured, then sets starting colors and animations
+def setup_lights_from_configuration(strands_config=None, set_lights_on=True, animation_starter=None):
+    # Expects that light strips have been configured, then sets starting colors and animations from the current
+    # mode's table (see ModeTables.py).  The mode's animations are handed to animation_starter, which starts them
+    # in animation processes unless told otherwise.  Switching from a mode set up here only changes the ranges
+    # and ids whose animation differs between the modes, the rest keep running
+    global shown_mode, last_mode_switch
+    started = time.monotonic()
     if not strands_config:
         strands_config = config.settings.get('strands')
-    light_data = []
-    mode_list = []
-
-    animations_to_run_for_this_mode = []
-
-    # Look through all data for each strand, build modes and add animations
-    strand_id = 0
-    for strand_name in strands_config:
-        config.log.info("Setting up default lights for strand - {}".format(strand_name))
-        strand = config.light_strips[strand_id]
-        data = strands_config.get(strand_name)
-        ids_data = data.get('ids', [])
-        id_ranges_data = data.get('id_ranges', [])
-
-        led_database = []
-        for i in range(strand.numPixels()):
-            led_database.append({})
-
-        # Look at the ID_RANGES section, and parse out any modes and animations
-        for id_range_data_name in id_ranges_data:
-            id_range_data = id_ranges_data.get(id_range_data_name)
-
-            ids = id_range_data.get('ids', "")
-            id_start = id_range_data.get('id_start', "")
-            id_end = id_range_data.get('id_end', "")
-            id_list = find_ids(ids, id_start, id_end, limit_to=strand.numPixels())
-
-            animations = id_range_data.get('animations', [])
-            default_anim = animations.get(config.current_mode, 'off')
-            parsed_anim = parse_animation_text(default_anim)
-
-            # Build mode and animation details
-            for anim in animations:
-                if anim not in mode_list:
-                    mode_list.append(anim)
-                if anim == config.current_mode and parsed_anim.get('animation'):
-                    anim_data = {'range_name': id_range_data_name, 'leds': id_list,
-                                 'animation': animations[anim], 'strip': strand, 'strip_id': strand_id}
-                    animations_to_run_for_this_mode.append(anim_data)
-
-            # Go through all the leds in the combined ranged and listed entries
-            for led_num in id_list:
-                led = int(led_num)
-                if led < strand.numPixels():
-                    picked_color = color_from_list_with_range(parsed_anim)
-                    if set_lights_on:
-                        strand.setPixelColor(led, picked_color)
-                    led_database[led] = {
-                        'id': led, 'color': picked_color, 'name': id_range_data_name, 'anim_text': default_anim
-                    }
-                    # config.log.info("- Strand {} - Pixel {} - color: {}".format(strand_name, led, default_color))
-                else:
-                    config.log.warning('Invalid led animation config: strand {} {}'.format(id_range_data_name, led))
-
-        # Now also look at individual LED items, and build animations and modes from those
-        for id_data_led in ids_data:
-            id_data = ids_data[id_data_led]
-            animations = id_data['animations'] if 'animations' in id_data else []
-            default_anim = animations[config.current_mode] if config.current_mode in animations else 'off'
-            id_name = id_data['name'] if 'name' in id_data else ''
-            parsed_anim = parse_animation_text(default_anim)
-
-            picked_color = color_from_list_with_range(parsed_anim)
-            if set_lights_on:
-                strand.setPixelColor(int(id_data_led), picked_color)
-            led_database[id_data_led] = {
-                'id': id_data_led, 'color': picked_color, 'name': id_name, 'anim_text': default_anim
-            }
-
-            for anim in animations:
-                if anim not in mode_list:
-                    mode_list.append(anim)
-                if anim == config.current_mode and parsed_anim.get('animation'):
-                    anim_data = {'range_name': id_name, 'leds': [id_data_led],
-                                 'animation': animations[anim], 'strip': strand, 'strip_id': strand_id}
-                    animations_to_run_for_this_mode.append(anim_data)
-
-        # config.log.info("- Strand {} - Pixels: {} - color: {}".format(strand_name, ids_data, default_color))
-        strand_id += 1
+    light_strips = config.light_strips[:len(strands_config)]
+    tables = mode_tables_for(strands_config, [strip.numPixels() for strip in light_strips])
+    table = tables.table(config.current_mode)
+    config.log.info("Setting up lights for mode {} on {} strands".format(config.current_mode, len(light_strips)))
+    config.animation_modes = list(tables.modes)
+
+    incremental = (animation_starter is None and set_lights_on and shown_mode is not None
+                   and shown_mode[0] is tables and config.settings.get('incremental_mode_switch', True))
+    if incremental:
+        with engine_lock:
+            switch = switch_mode_incrementally(shown_mode[1], table, light_strips,
+                                               transition_for(config.current_mode))
+    else:
         if set_lights_on:
+            for strand, colors, lit in zip(light_strips, table.colors, table.lit):
+                if len(lit):
+                    index = strand.index(lit)
+                    strand.write(index, colors[index])
+                strand.show()
+
+        # Even with no animations, so that the previous mode's animations stop
+        animations_to_run_for_this_mode = [dict(anim, leds=list(anim['leds']), strip=light_strips[anim['strip_id']])
+                                           for anim in table.animations]
+        (animation_starter or start_multiple_animations)(animations_to_run_for_this_mode)
+        switch = {'changed_ranges': sum(len(texts) for texts in table.texts),
+                  'touched_leds': sum(len(lit) for lit in table.lit),
+                  'animations_started': len(animations_to_run_for_this_mode)}
+
+    shown_mode = (tables, table) if animation_starter is None and set_lights_on else None
+    last_mode_switch = dict(switch, mode=config.current_mode, incremental=bool(incremental),
+                            ms=round(1000 * (time.monotonic() - started), 3))
+    config.log.info("Mode {} set up, {} ranges and {} LEDs changed".format(
+        config.current_mode, switch['changed_ranges'], switch['touched_leds']))
+
+    return table.light_data
+
+
+def engine_animations():
+    # (engine, animation id, animation_data) of every animation in a running engine
+    for p in running_processes:
+        process = p.get('process')
+        if isinstance(process, AnimationProcess.AnimationProcess) and process.is_alive():
+            for strip_id in range(len(config.light_strips)):
+                for animation_id, animation_data in process.animations_on(strip_id):
+                    yield process, animation_id, animation_data
+
+
+def transition_for(mode):
+    # Style and seconds of the transition into a mode, which 'mode_transitions' can set for each mode
+    mode_transition = (config.settings.get('mode_transitions') or {}).get(mode) or {}
+    style = mode_transition.get('transition', config.settings.get('transition', 'snap'))
+    seconds = float(mode_transition.get('seconds', config.settings.get('transition_seconds', 0)) or 0)
+    if style not in TRANSITIONS:
+        config.log.warning("Unknown transition '{}', valid transitions are {}".format(style, TRANSITIONS))
+        style = 'snap'
+    return style, seconds
+
+
+def switch_mode_incrementally(previous, table, light_strips, transition=('snap', 0)):
+    """Change from the previous mode's table to this one, only stopping, recoloring and starting the ranges and
+    ids whose animation text differs.  Animations started by hand (from /animation) are stopped as well.
+
+    With a transition other than snap, the engines blend from the old mode to the new one, fading out the
+    animations that are stopping while the new ones fade in """
+    style, seconds = transition
+    transitioning = style != 'snap' and seconds > 0
+    changed = set(table.changed_entries(previous))
+    touched = [np.zeros(strip.numPixels(), dtype=bool) for strip in light_strips]
+    for strip_id, entry_num in changed:
+        touched[strip_id][table.entries[strip_id][entry_num].ids] = True
+
+    stopping = []
+    for process, animation_id, animation_data in engine_animations():
+        entry = animation_data.get('entry')
+        if entry is None or tuple(entry) in changed:
+            stopping.append((process, animation_id))
+            strip_id = animation_data.get('strip_id')
+            if entry is None and strip_id is not None and int(strip_id) < len(touched):
+                touched[int(strip_id)][animation_data.get('id_list', [])] = True
+    starting = [anim for anim in table.animations if anim['entry'] in changed]
+
+    if transitioning:
+        # Every strip that changes is blended by the engine that animates it, even if it only changes color
+        strip_ids = {strip_id for strip_id, mask in enumerate(touched) if mask.any()}
+        strip_ids |= {anim['strip_id'] for anim in starting}
+        engines = {}
+        for strip_id in strip_ids:
+            engines.setdefault(animation_worker_for(strip_id), set()).add(strip_id)
+        for process, _ in stopping:
+            engines.setdefault(process, set())
+        for engine, engine_strip_ids in engines.items():
+            engine.send_transition(engine_strip_ids, style, seconds,
+                                   [animation_id for process, animation_id in stopping if process is engine])
+
+    # New static colors first, so the LEDs of stopped animations go straight to them
+    lit = [np.zeros(strip.numPixels(), dtype=bool) for strip in light_strips]
+    for strip_id, strip_lit in enumerate(table.lit):
+        lit[strip_id][strip_lit] = True
+    for strip_id, strand in enumerate(light_strips):
+        ids = np.flatnonzero(touched[strip_id] & lit[strip_id])
+        if not len(ids):
+            continue
+        colors = table.colors[strip_id][ids]
+        engine = animation_worker_for(strip_id) if transitioning else running_worker_for(strip_id)
+        if engine is not None:
+            engine.send_recolor(strip_id, ids, colors)
+        else:
+            strand.sync_to_shown()
+            strand.write(ids, colors)
             strand.show()
-        light_data.append(led_database)
 
-    config.animation_modes = mode_list
+    if not transitioning:
+        for process, animation_id in stopping:
+            process.send_remove(animation_id)
 
-    if len(animations_to_run_for_this_mode) > 1:
-        start_multiple_animations(animations_to_run_for_this_mode)
+    for anim in starting:
+        animation_worker_for(anim['strip_id']).send_add(
+            animation_data_for(dict(anim, strip=light_strips[anim['strip_id']])))
 
-    return light_data
+    return {'changed_ranges': len(changed), 'touched_leds': int(sum(mask.sum() for mask in touched)),
+            'animations_stopped': len(stopping), 'animations_started': len(starting),
+            'transition': style if transitioning else 'snap', 'transition_seconds': seconds if transitioning else 0}
 
 
 def start_multiple_animations(animation_list):
+    global running_processes
+    previous_processes = running_processes
+    running_processes = []
 
-    # Stop all existing animations
-    stop_everything()
-
-    # TODO: Consider a new process for each strip?
-    animation_process = AnimationProcess.AnimationProcess()
-
-    details_anim = []
-    details_strands = []
-    details_ids = []
+    # Either run everything in one process, or (engine mode 'per_strand') give each strand its own worker so a
+    # heavy animation on one strand can't slow the others
+    workers = {}
+    per_strand = config.setting('animation_engine', 'single') == 'per_strand'
+    for anim in animation_list:
+        worker_key = anim.get('strip_id') if per_strand else 'all'
+        workers.setdefault(worker_key, []).append(anim)
+
+    # Standby engines build the new animations while the old ones are still showing
+    cores = worker_cores()
+    new_workers = []
+    for worker_num, worker_key in enumerate(workers):
+        cpu = cores[worker_num % len(cores)] if per_strand and cores else None
+        new_workers.append((start_animation_worker(workers[worker_key], worker_key, cpu, run=False), cpu))
+
+    # Stop all existing animations, put the static colors back, then hand over to the new workers
+    for p in previous_processes:
+        end_process(p.get('process'))
+    for light_strip in config.light_strips:
+        light_strip.resend()
+        light_strip.show()
+    for animation_process, cpu in new_workers:
+        run_animation_worker(animation_process, cpu)
+
+    config.log.info("Started {} animation process(es) holding {} animations".format(len(workers),
+                                                                                      len(animation_list)))
+    prewarm_engines(len(workers))
+
+
+def prewarm_engines(count=1):
+    # Keep standby engines running, so the next mode switch doesn't have to wait for processes to start
+    if not config.settings.get('standby_engines', True):
+        return
+    while len(standby_engines) < count:
+        standby = AnimationProcess.AnimationProcess(held=True)
+        standby.daemon = True
+        standby.start()
+        standby_engines.append(standby)
+
+
+def worker_cores():
+    # Cores available for pinning animation workers, leaving the first core to the web server if there are others
+    if not hasattr(os, 'sched_getaffinity'):
+        return []
+    cores = sorted(os.sched_getaffinity(0))
+    return cores[1:] if len(cores) > 1 else cores
+
+
+def start_animation_worker(animation_list, worker_key, cpu=None, run=True):
+    # Use a standby engine if one is waiting, otherwise start a new process
+    standby = None
+    while standby_engines and standby is None:
+        standby = standby_engines.pop(0)
+        standby = standby if standby.is_alive() else None
+    animation_process = standby or AnimationProcess.AnimationProcess(cpu=cpu)
 
     for anim in animation_list:
-        animation_text = anim.get('animation')
-        id_list = anim.get('leds', [])
-        range_name = anim.get('range_name')
-        strip = anim.get('strip')
-        strip_id = anim.get('strip_id')
-        command_parsed = parse_animation_text(animation_text)
-        animation_name = command_parsed.get('animation', 'unknown')
+        animation_data = animation_data_for(anim)
+        if animation_process.held:
+            animation_process.send_add(animation_data)
+        else:
+            animation_process.add_animation(animation_data)
 
-        details_anim.append(animation_name)
-        details_strands.append(strip_id)
-        details_ids += id_list
+    # TODO: Add more/better details to this list of process info.  What it animates is read from the engine, as
+    # switching modes and adding animations change that after it starts
+    process_details = {'worker': worker_key,
+                       'cpu': cpu}
 
-        animation_data = {'strip': strip, 'strip_id': strip_id, 'id_list': id_list, 'animation': animation_name,
-                          'command': animation_text, 'command_parsed': command_parsed, 'range_name': range_name}
+    global running_processes
+    running_processes.append({'process': animation_process, 'arguments': process_details, 'started': datetime.now()})
+    if run:
+        run_animation_worker(animation_process, cpu)
+    return animation_process
 
-        animation_process.add_animation(animation_data)
 
-    # TODO: Add more/better details to this list of process info
-    process_details = {'animation': ", ".join(details_anim),
-                       'strip_id': ", ".join(map(str, details_strands)),
-                       'id_list': ", ".join(map(str, details_ids))}
+def animation_data_for(anim):
+    # Turn an animation found by setup_lights_from_configuration into what an AnimationProcess expects
+    animation_text = anim.get('animation')
+    command_parsed = parse_animation_text(animation_text)
+    return {'strip': anim.get('strip'), 'strip_id': anim.get('strip_id'), 'id_list': anim.get('leds', []),
+            'animation': command_parsed.get('animation', 'unknown'), 'command': animation_text,
+            'command_parsed': command_parsed, 'range_name': anim.get('range_name'), 'entry': anim.get('entry')}
 
-    global running_processes
-    running_processes.append({'process': animation_process, 'arguments': process_details, 'started': datetime.now()})
-    animation_process.daemon = True
-    animation_process.start()
 
-    # TODO: Check if this runs after process is killed
-    config.log.info("Animation Process holding {} animations Ended".format(len(animation_list)))
+def run_animation_worker(animation_process, cpu=None):
+    if animation_process.held:
+        animation_process.take_over(cpu)
+    else:
+        animation_process.daemon = True
+        animation_process.start()
 
 
 # Process handling
@@ -273,39 +390,221 @@ def stop_process(process_id):
             msg = "Stopping {} with args {}".format(process.name, p.get('arguments'))
             config.log.debug(msg)
             running_processes.remove(p)
-            process.kill()
-            process.join()
+            end_process(process)
     return msg
 
 
 def stop_everything():
-    global running_processes
+    global running_processes, shown_mode
+    shown_mode = None
     if len(running_processes):
         config.log.info("Stopping {} long processes".format(len(running_processes)))
 
         for p in running_processes:
             process = p.get('process')
             config.log.debug("-Stopping {} with args {}".format(process.name, p.get('arguments')))
-            process.kill()
-            process.join()
+            end_process(process)
 
         running_processes = []
 
 
+def end_process(process):
+    # Animation engines are asked to stop after their current frame, anything else (or a stuck engine) is killed
+    if isinstance(process, AnimationProcess.AnimationProcess):
+        process.stop()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+def running_worker_for(strip_id):
+    # The running engine that animates this strip, if there is one
+    per_strand = config.setting('animation_engine', 'single') == 'per_strand'
+    worker_key = strip_id if per_strand else 'all'
+    for p in running_processes:
+        if isinstance(p.get('process'), AnimationProcess.AnimationProcess) and \
+                p['arguments'].get('worker') == worker_key and p['process'].is_alive():
+            return p['process']
+    return None
+
+
+def animation_worker_for(strip_id):
+    # The running engine that animates this strip, starting an (idle) one if there isn't one
+    worker = running_worker_for(strip_id)
+    if worker is not None:
+        return worker
+
+    per_strand = config.setting('animation_engine', 'single') == 'per_strand'
+    worker_key = strip_id if per_strand else 'all'
+    workers = [p for p in running_processes if isinstance(p.get('process'), AnimationProcess.AnimationProcess)]
+    cores = worker_cores()
+    cpu = cores[len(workers) % len(cores)] if per_strand and cores else None
+    return start_animation_worker([], worker_key, cpu)
+
+
+def add_animation(animation_data):
+    """Add an animation to the running engine.  Animations already on any of its LEDs give those LEDs up,
+    and are removed if that leaves them with none """
+    strip_id = animation_data.get('strip_id')
+    new_ids = set(animation_data.get('id_list', []))
+    replaced = []
+    with engine_lock:
+        for p in running_processes:
+            process = p.get('process')
+            if not isinstance(process, AnimationProcess.AnimationProcess) or not process.is_alive():
+                continue
+            for animation_id, existing in process.animations_on(strip_id):
+                existing_ids = existing.get('id_list', [])
+                if new_ids.isdisjoint(existing_ids):
+                    continue
+                remaining_ids = [led for led in existing_ids if led not in new_ids]
+                if remaining_ids:
+                    process.send_replace(animation_id, dict(existing, id_list=remaining_ids))
+                else:
+                    process.send_remove(animation_id)
+                replaced.append(animation_id)
+
+        result = animation_worker_for(strip_id).send_add(animation_data)
+    result['replaced'] = replaced
+    return result
+
+
+def find_animation_process(animation_id):
+    for p in running_processes:
+        process = p.get('process')
+        if isinstance(process, AnimationProcess.AnimationProcess) and process.has_animation(animation_id):
+            return process
+    return None
+
+
+def update_animation(animation_id, parameters):
+    # Change settings of one animation in a running engine without restarting it
+    process = find_animation_process(animation_id)
+    if not process:
+        return {'ok': False, 'message': 'Unknown animation {}'.format(animation_id)}
+    return process.send_update(animation_id, parameters)
+
+
+def remove_animation(animation_id):
+    process = find_animation_process(animation_id)
+    if not process:
+        return {'ok': False, 'message': 'Unknown animation {}'.format(animation_id)}
+    return process.send_remove(animation_id)
+
+
+def engine_details(engine):
+    # What an engine is animating right now, as /state shows it
+    animations = [data for _, data in engine.animations()]
+    return {'animation': ", ".join(data.get('command_parsed', {}).get('animation', 'unknown') for data in animations),
+            'strand': ", ".join(map(str, sorted(set(data.get('strip_id') for data in animations)))),
+            'id_list': ", ".join(str(led) for data in animations for led in data.get('id_list', []))}
+
+
 def get_process_info_as_object():
     processes = []
     for p in running_processes:
         process = p.get('process')
         arguments = p.get('arguments', {})
 
-        processes.append({'process': process.pid,
-                          'name': process.name,
-                          'started': p.get('started').strftime("%H:%M:%S"),
-                          'animation': arguments.get('animation', 'unknown'),
-                          'strand': arguments.get('strip_id', 'unknown'),
-                          'id_list': arguments.get('id_list', 'unknown')})
+        process_info = {'process': process.pid,
+                        'name': process.name,
+                        'started': p.get('started').strftime("%H:%M:%S"),
+                        'animation': arguments.get('animation', 'unknown'),
+                        'strand': arguments.get('strip_id', 'unknown'),
+                        'id_list': arguments.get('id_list', 'unknown')}
+        if isinstance(process, AnimationProcess.AnimationProcess):
+            process_info.update(engine_details(process))
+            process_info['worker'] = arguments.get('worker')
+            process_info['cpu'] = arguments.get('cpu')
+            process_info['timing'] = process.timing()
+            process_info['frame_rates'] = process.frame_rates()
+        processes.append(process_info)
     return processes
 
+
+def profile_engines(seconds, mode='stats', sort='cumulative'):
+    """Start profiling every running animation engine, returning where each profile will be written """
+    if mode not in Profiler.PROFILE_MODES:
+        return [{'ok': False, 'message': 'Unknown profile mode {}, options: {}'.format(mode, Profiler.PROFILE_MODES)}]
+    if sort not in Profiler.PROFILE_SORTS:
+        return [{'ok': False, 'message': 'Unknown profile sort {}, options: {}'.format(sort, Profiler.PROFILE_SORTS)}]
+
+    results = []
+    for p in running_processes:
+        process = p.get('process')
+        if not isinstance(process, AnimationProcess.AnimationProcess) or not process.is_alive() or process.held:
+            continue
+        result = process.profile(seconds, mode, sort, config.setting('profile_folder', 'profiles'))
+        result['worker'] = p.get('arguments', {}).get('worker')
+        results.append(result)
+    return results
+
+
+def get_metrics_text(commands_in_flight=None):
+    """Render loop metrics of every animation engine in the Prometheus text format.  commands_in_flight has the
+    number of web and MQTT commands being handled, by source """
+    metrics = MetricsText()
+    metrics.declare('curio_animation_next_seconds', 'histogram', "Time taken by an animation's next()")
+    metrics.declare('curio_animation_requested_fps', 'gauge', 'Frames per second an animation asks for')
+    metrics.declare('curio_animation_actual_fps', 'gauge', 'Frames per second an animation is getting')
+    metrics.declare('curio_animation_missed_deadlines_total', 'counter',
+                    'Times an animation fell more than a frame behind')
+    metrics.declare('curio_strand_show_seconds', 'histogram', 'Time taken to show a frame on a strand')
+    metrics.declare('curio_transition_seconds', 'histogram', 'Time taken by a transition between modes')
+    metrics.declare('curio_transition_frame_seconds', 'histogram', 'Time taken to blend a frame of a transition')
+    metrics.declare('curio_engine_frames_total', 'counter', 'Animation frames rendered by an engine')
+    metrics.declare('curio_engine_load', 'gauge', 'Share of time an engine spends rendering and showing')
+    metrics.declare('curio_engine_pending_commands', 'gauge', 'Commands waiting for an engine to apply them')
+    metrics.declare('curio_commands_in_flight', 'gauge', 'Web requests and MQTT messages being handled')
+    metrics.declare('curio_time_to_first_light_seconds', 'gauge', 'Time from starting until the lights came on')
+
+    strand_names = list(config.settings.get('strands', {}).keys())[:len(config.light_strips)]
+    strand_names += [str(num) for num in range(len(strand_names), len(config.light_strips))]
+    show_durations = [[] for _ in strand_names]
+    buckets = None
+    for p in list(running_processes):
+        process = p.get('process')
+        if not isinstance(process, AnimationProcess.AnimationProcess) or not process.is_alive():
+            continue
+        engine = {'worker': p.get('arguments', {}).get('worker'), 'pid': process.pid}
+        buckets = process.duration_buckets
+
+        next_durations = dict(process.next_durations())
+        for rates in process.frame_rates():
+            labels = dict(engine, id=rates['id'], animation=rates['animation'], strand=rates['strip_id'],
+                          range=rates['range_name'])
+            if rates['id'] in next_durations:
+                metrics.histogram('curio_animation_next_seconds', next_durations[rates['id']], buckets, labels)
+            if 'requested_fps' in rates:
+                metrics.sample('curio_animation_requested_fps', rates['requested_fps'], labels)
+                metrics.sample('curio_animation_actual_fps', rates['actual_fps'], labels)
+                metrics.sample('curio_animation_missed_deadlines_total', rates['missed_deadlines'], labels)
+
+        for strand_num, snapshot in enumerate(process.show_durations(len(strand_names))):
+            show_durations[strand_num].append(snapshot)
+
+        transitions, transition_frames = process.transition_durations()
+        metrics.histogram('curio_transition_seconds', transitions, TRANSITION_BUCKETS, engine)
+        metrics.histogram('curio_transition_frame_seconds', transition_frames, buckets, engine)
+
+        timing = process.timing()
+        metrics.sample('curio_engine_frames_total', timing['frames'], engine)
+        metrics.sample('curio_engine_load', timing['load'], engine)
+        metrics.sample('curio_engine_pending_commands', process.pending_commands(), engine)
+
+    # Each strand is shown by whichever engines animate it, so their show() durations are added together
+    for strand_name, snapshots in zip(strand_names, show_durations):
+        merged = merge_snapshots(snapshots)
+        if merged and merged[1]:
+            metrics.histogram('curio_strand_show_seconds', merged, buckets, {'strand': strand_name})
+
+    for source, count in (commands_in_flight or {}).items():
+        metrics.sample('curio_commands_in_flight', count, {'source': source})
+    if 'first_light_seconds' in config.startup:
+        metrics.sample('curio_time_to_first_light_seconds', config.startup['first_light_seconds'],
+                       {'config_cache': config.startup.get('config_cache')})
+    return metrics.text()
+
 # -----------------------------
 # Not Used:
 # -----------------------------
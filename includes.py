@@ -8,9 +8,18 @@ __status__ = "Development"
 
 import logging
 import random
-from colour import Color as ColourColor
+from collections import namedtuple
+from functools import lru_cache
+from colour import Color as ColourColor, COLOR_NAME_TO_RGB
 
-animation_options = ['rainbow', 'wheel', 'pulsing', 'warp', 'blinkenlicht', 'blinking', 'twinkle']
+animation_options = ['rainbow', 'wheel', 'pulsing', 'warp', 'blinkenlicht', 'blinking', 'twinkle', 'playback']
+pulse_modes = ['linear', 'sin', 'spike']  # How pulsing animations ramp their brightness
+speed_words = {'slow': 1, 'gentle': 2, 'medium': 3, 'speedy': 4, 'fast': 6}  # Speeds 1 (slow) to 6 (fast)
+case_sensitive_settings = ['file']  # Animation text settings that keep their case, eg file:shows/Combat.frames
+ANIMATION_TEXT_CACHE_SIZE = 1024  # Different animation texts kept parsed
+
+AnimationSpec = namedtuple('AnimationSpec', ['settings', 'errors'])
+ParseError = namedtuple('ParseError', ['position', 'text', 'message'])
 
 
 class RGBW(int):
@@ -175,7 +184,56 @@ def find_ids(ids=None, id_start=None, id_end=None, limit_to=None):
     return id_list
 
 
+def color_name_table():
+    # Every color name the colour library knows (the X11/CSS names), converted the same way as any other color
+    table = {}
+    for name in COLOR_NAME_TO_RGB:
+        colour_rgb = ColourColor(name)
+        table[name] = Color(int(colour_rgb.red * 255), int(colour_rgb.green * 255), int(colour_rgb.blue * 255))
+    return table
+
+
+color_names = color_name_table()
+
+
+def color_from_name(name):
+    """Color from a name like 'red' or a hex color like '#ff8800', raises ValueError if not recognized """
+    color = color_names.get(name)
+    if color is None:
+        try:
+            colour_rgb = ColourColor(name)
+            color = Color(int(colour_rgb.red * 255), int(colour_rgb.green * 255), int(colour_rgb.blue * 255))
+        except (AttributeError, ValueError) as e:
+            raise ValueError(str(e))
+    return color
+
+
 def parse_animation_text(text):
+    """Settings of an animation text like "red and white, pulsing, fast", as a new dict that callers can change.
+    The text is only parsed the first time it is seen, see compile_animation_text """
+    spec = compile_animation_text(text)
+    output = {key: thawed(value) for key, value in spec.settings}
+    if spec.errors:
+        output['errors'] = [error._asdict() for error in spec.errors]
+    return output
+
+
+def thawed(value):
+    if isinstance(value, tuple):
+        return [thawed(item) for item in value]
+    return value
+
+
+def frozen(value):
+    if isinstance(value, list):
+        return tuple(frozen(item) for item in value)
+    return value
+
+
+@lru_cache(maxsize=ANIMATION_TEXT_CACHE_SIZE)
+def compile_animation_text(text):
+    """Parse an animation text into an AnimationSpec - its settings as (name, value) pairs, with lists stored
+    as tuples so the cached spec can't be changed, and any parse errors with their position in the text """
     animation = None
     loop_modifier = None
     loop_speed = None
@@ -183,67 +241,78 @@ def parse_animation_text(text):
     color_list = []
     variation_list = []  # Color random variations that go with each color
     extras = []
+    errors = []
+    animation_text = text if text else None
 
     # If "off" passed in, field is set to: False, catch that with an if statement
     if text and len(text) > 3:
         # Format is 'color word(s)', 'animation', 'modifier', 'speed', 'special'
         # example: "yellow, pulsing, random" or "red and white, pulsing" or "blue:.1"
+        position = len(text) - len(text.lstrip())  # Where each piece starts in the original text
         text = text.strip().lower()
 
         # Break by commas into named chunks
         words = text.split(",")
+        word_positions = []
+        for word in words:
+            word_positions.append(position)
+            position += len(word) + 1
+
         color_name = words[0]
         if color_name == 'none':
             color_name = 'blue'
 
         # separate out multiple colors
         colors_names = color_name.split(' and ')
+        position = word_positions[0]
         for color_name_split in colors_names:
+            # parse out any : after color names for random variations, eg Blue:.1 or Pink:.2:0:.1
+            color_var_split = color_name_split.split(':')
             try:
-                # parse out any : after color names for random variations, eg Blue:.1 or Pink:.2:0:.1
-                color_var_split = color_name_split.split(':')
+                color = color_from_name(color_var_split[0])
+            except ValueError:
+                errors.append(ParseError(position, color_var_split[0], 'color not recognized'))
+            else:
                 variations = []
-                if len(color_var_split) > 1:
-                    variations = color_var_split[1:]
-
-                colour_rgb = ColourColor(color_var_split[0])
-                color = Color(int(colour_rgb.red * 255), int(colour_rgb.green * 255), int(colour_rgb.blue * 255))
+                variation_position = position + len(color_var_split[0]) + 1
+                for variation in color_var_split[1:]:
+                    try:
+                        float(variation)
+                        variations.append(variation)
+                    except ValueError:
+                        errors.append(ParseError(variation_position, variation, 'color variation is not a number'))
+                    variation_position += len(variation) + 1
                 color_list.append(color)
                 variation_list.append(variations)
-            except Exception:
-                print(
-                    'Color "{}" not recognized from config.yaml strand animation settings'.format(color_name_split))
+            position += len(color_name_split) + len(' and ')
 
         # See if an animation or supporting information was entered
         if len(words) > 1:
-            for word in words[1:]:
+            original_words = animation_text.strip().split(",")
+            for word_num, word in enumerate(words[1:], 1):
                 text = word.strip().lower()
                 if valid_animation(text):
                     animation = text
                 elif text in ['random', 'centered', 'cycled']:
                     loop_modifier = text
-                elif text in ['slow', '1', 1]:
-                    loop_speed = 1
-                elif text in ['gentle', '2', 2]:
-                    loop_speed = 2
-                elif text in ['medium', '3', 3]:
-                    loop_speed = 3
-                elif text in ['speedy', '4', 4]:
-                    loop_speed = 4
-                elif text in ['medium', '5', 5]:
-                    loop_speed = 5
-                elif text in ['fast', '6', 6]:
-                    loop_speed = 6
+                elif speed_from_text(text) is not None:
+                    loop_speed = speed_from_text(text)
                 elif ':' in text:
                     # There is a variable in the text, parse it out
                     pieces = text.split(":")
                     if len(pieces) > 1:
                         var_name = pieces[0]
                         var_val = pieces[1]
+                        if var_name in case_sensitive_settings:
+                            var_val = original_words[word_num].strip().split(":", 1)[1]
                         extras.append({var_name: var_val})
+                elif text not in ['', 'none']:
+                    word_position = word_positions[word_num] + len(word) - len(word.lstrip())
+                    errors.append(ParseError(word_position, text, 'not an animation, modifier, speed or setting'))
 
     output = {'color_list': color_list, 'color_variations': variation_list, 'special': special,
-              'animation': animation, 'loop_modifier': loop_modifier, 'loop_speed': loop_speed}
+              'animation': animation, 'loop_modifier': loop_modifier, 'loop_speed': loop_speed,
+              'text': animation_text}
 
     if len(extras):
         for dic in extras:
@@ -253,40 +322,63 @@ def parse_animation_text(text):
     # Take out empty keys
     output = {k: v for k, v in output.items() if v is not None or (type(v) == list and len(v))}
 
-    return output
+    for error in errors:
+        # Only shown the first time a text is parsed, as the result is cached
+        print('Animation text "{}": {} "{}" at position {}'.format(animation_text, error.message, error.text,
+                                                                  error.position))
+
+    return AnimationSpec(tuple((key, frozen(value)) for key, value in output.items()), tuple(errors))
 
 
 def valid_animation(anim):
     return anim in animation_options
+
+
+def checked_number(value, minimum, maximum=float('inf'), convert=float):
+    # value as a number from minimum to maximum, raising ValueError if it isn't one
+    number = convert(value)
+    if not minimum <= number <= maximum:
+        raise ValueError('{} is not from {} to {}'.format(value, minimum, maximum))
+    return number
+
+
+def speed_from_text(text):
+    # Loop speed of a speed word or a number from 1 to 6, or None if it isn't one
+    text = str(text).strip().lower()
+    if text in speed_words:
+        return speed_words[text]
+    if text in ['1', '2', '3', '4', '5', '6']:
+        return int(text)
+    return None
 # TODO: Lookup functions to run
 
 
-def color_from_list_with_range(parsed_animation):
+def color_from_list_with_range(parsed_animation, rng=random):
+    # rng can be a random.Random(seed) for repeatable colors, FrameBuffer.colors_from_list_with_range picks many at once
     color_list = parsed_animation['color_list']
     modifier_list = parsed_animation['color_variations']
 
     if len(color_list):
-        color_number_to_use = random.choice(range(len(color_list)))
+        color_number_to_use = rng.choice(range(len(color_list)))
         out_color = color_list[color_number_to_use]
         out_modifier = modifier_list[color_number_to_use] if len(modifier_list) >= color_number_to_use else []
 
         if len(out_modifier) > 0:
-            out_color = random_color_range(out_color, out_modifier)
+            out_color = random_color_range(out_color, out_modifier, rng)
     else:
         out_color = 0
 
     return out_color
 
 
-def random_color_with_range_from_list(colors, variations, default_variation=.2):
-    color_i = random.randint(0, len(colors) - 1)
+def random_color_with_range_from_list(colors, variations, default_variation=.2, rng=random):
+    color_i = rng.randint(0, len(colors) - 1)
     color_range = variations[color_i] if len(variations) > color_i else [default_variation]
-    return random_color_range(colors[color_i], color_range)
+    return random_color_range(colors[color_i], color_range, rng)
 
 
-def random_color_range(color, ranges):
-    # Start with a Color, then return another color close to it based on percentages in 'ranges'.
-    # example: "Color(120, 100, 100), [.1]" or "Color(120, 100, 100), [.2,0,.2]"
+def color_range_amounts(ranges):
+    # Turn percentages like [.1] or [.2,0,.2] into how far (0..255) red, green and blue may each vary
     if type(ranges) == float:
         ranges = [ranges]
     ranges = ranges or []
@@ -301,16 +393,20 @@ def random_color_range(color, ranges):
         range_g = range_r
         range_b = range_r
 
-    range_r = int(float(range_r) * 255)
-    range_g = int(float(range_g) * 255)
-    range_b = int(float(range_b) * 255)
+    return int(float(range_r) * 255), int(float(range_g) * 255), int(float(range_b) * 255)
+
+
+def random_color_range(color, ranges, rng=random):
+    # Start with a Color, then return another color close to it based on percentages in 'ranges'.
+    # example: "Color(120, 100, 100), [.1]" or "Color(120, 100, 100), [.2,0,.2]"
+    range_r, range_g, range_b = color_range_amounts(ranges)
 
     r = color.r
     g = color.g
     b = color.b
 
-    new_r = clamp(random.randint(r - range_r, r + range_r), 0, 255)
-    new_g = clamp(random.randint(g - range_g, g + range_g), 0, 255)
-    new_b = clamp(random.randint(b - range_b, b + range_b), 0, 255)
+    new_r = clamp(rng.randint(r - range_r, r + range_r), 0, 255)
+    new_g = clamp(rng.randint(g - range_g, g + range_g), 0, 255)
+    new_b = clamp(rng.randint(b - range_b, b + range_b), 0, 255)
 
     return Color(new_r, new_g, new_b)
@@ -10,15 +10,75 @@ Puts long-running tasks into processes that can be tracked and killed
 from __main__ import app, mqtt_client
 import functions
 import config
-from includes import merge_dictionaries
+from includes import merge_dictionaries, speed_from_text, speed_words, checked_number, pulse_modes
+from PowerLimiter import supply_info
 
 import os
 import json
-from flask import render_template, request
+import threading
+import time
+from flask import Response, render_template, request
 from colour import Color as Colour
 
+DEFAULT_PROFILE_SECONDS = 5
+MAX_PROFILE_SECONDS = 120
+PROFILE_WRITE_TIMEOUT = 5  # Seconds to wait for an engine to write its profile after profiling
+
+# Settings /animation/update can change: how to read each one (raising ValueError if it isn't valid), and what
+# it should be
+UPDATE_SETTINGS = {
+    'density': (lambda value: checked_number(value, 0, 1), 'a number from 0 to 1'),
+    'pulse_height': (lambda value: checked_number(value, 1, convert=int), 'a whole number from 1'),
+    'position': (lambda value: checked_number(value, 0), 'seconds from 0'),
+    'mode': (lambda value: one_of(value, pulse_modes), 'one of ' + ', '.join(pulse_modes)),
+    'loop': (lambda value: one_of(value, ['true', 'false', 'yes', 'no', 'on', 'off', '1', '0']), 'true or false'),
+}
+
+# Web requests and MQTT messages being handled right now, for /metrics
+commands_in_flight = {'web': 0, 'mqtt': 0}
+commands_in_flight_lock = threading.Lock()
+
+
+def one_of(value, options):
+    # value (in lower case) if it is one of the options, raising ValueError if not
+    if value.lower() not in options:
+        raise ValueError('{} is not one of {}'.format(value, options))
+    return value.lower()
+
+
+def profile_seconds(value):
+    # Seconds to profile for, at most MAX_PROFILE_SECONDS, or None if value isn't a positive number
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return min(seconds, MAX_PROFILE_SECONDS) if seconds > 0 else None
+
+
+def count_command(source, change):
+    with commands_in_flight_lock:
+        commands_in_flight[source] += change
+
+
+@app.before_request
+def count_web_request():
+    count_command('web', 1)
+
+
+@app.teardown_request
+def uncount_web_request(exception=None):
+    count_command('web', -1)
+
 
 def handle_mqtt_message(message):
+    count_command('mqtt', 1)
+    try:
+        route_mqtt_message(message)
+    finally:
+        count_command('mqtt', -1)
+
+
+def route_mqtt_message(message):
     data = dict(
         topic=message.topic,
         payload=message.payload.decode()
@@ -34,6 +94,17 @@ def handle_mqtt_message(message):
 
     if payload == 'clear':
         off_view()
+    elif payload.startswith('profile'):
+        # eg 'profile', 'profile:10' or 'profile:10:stacks' - written to the profile folder, see /profile
+        message = payload.split(":")
+        seconds = profile_seconds(message[1]) if len(message) > 1 else DEFAULT_PROFILE_SECONDS
+        mode = message[2] if len(message) > 2 else 'stats'
+        if seconds is None:
+            config.log.warning("Invalid MQTT profile seconds '{}', expected a number up to {}".format(
+                message[1], MAX_PROFILE_SECONDS))
+        else:
+            for result in functions.profile_engines(seconds, mode):
+                config.log.info('Profile: {} {}'.format(result.get('message'), result.get('paths', '')))
     elif payload.startswith('mode'):
         message = payload.split(":")
         if len(message) > 1:
@@ -66,8 +137,8 @@ def action_mode(mode):
     config.current_mode = mode
     if mqtt_client:
         mqtt_client.publish(config.setting('mqtt_publish_mode_topic'), mode)
-    functions.setup_lights_from_configuration()
-    return "Starting action mode '{}'".format(mode)
+    config.light_data = functions.setup_lights_from_configuration()
+    return "Starting action mode '{}', {} LEDs changed".format(mode, functions.last_mode_switch.get('touched_leds'))
 
 
 # ----------------------------
@@ -83,6 +154,45 @@ def remove_animation_view():
     return msg
 
 
+@app.route("/animation/update")
+def update_animation_view():
+    # Change an animation inside the running engine, eg: /animation/update?id=3&speed=5&color=red and white
+    # or seek a playback: /animation/update?id=4&position=30
+    animation_id = request.args.get('id', None)
+    if not animation_id:
+        return 'Animation id required'
+
+    parameters = {}
+    if request.args.get('speed'):
+        parameters['loop_speed'] = speed_from_text(request.args.get('speed'))
+        if parameters['loop_speed'] is None:
+            return Response("Unknown speed '{}', use 1 to 6 or one of {}".format(
+                request.args.get('speed'), ', '.join(speed_words)), status=400, mimetype='text/plain')
+    if request.args.get('color'):
+        parsed_colors = functions.parse_animation_text(request.args.get('color'))
+        parameters['color_list'] = parsed_colors.get('color_list', [])
+        parameters['color_variations'] = parsed_colors.get('color_variations', [])
+    for name, (read_setting, expected) in UPDATE_SETTINGS.items():
+        if request.args.get(name):
+            try:
+                parameters[name] = read_setting(request.args.get(name))
+            except ValueError:
+                return Response("Invalid {} '{}', expected {}".format(name, request.args.get(name), expected),
+                                status=400, mimetype='text/plain')
+
+    result = functions.update_animation(int(animation_id), parameters)
+    return "Animation {}: {}".format(animation_id, result.get('message'))
+
+
+@app.route("/animation/stop")
+def stop_animation_view():
+    animation_id = request.args.get('id', None)
+    if not animation_id:
+        return 'Animation id required'
+    result = functions.remove_animation(int(animation_id))
+    return "Animation {}: {}".format(animation_id, result.get('message'))
+
+
 # TODO: Route from mqtt and from calls
 @app.route("/animation")
 def add_animation_view():
@@ -103,7 +213,10 @@ def add_animation_view():
 
     valid_data = (type(strand) == str or type(strand) == int) and int(strand) < len(config.light_strips)
 
-    if valid_data and functions.valid_animation(animation):
+    if not functions.valid_animation(animation):
+        msg = "Animation {} not recognized, options: {}".format(animation, animation_text)
+
+    elif valid_data:
         light_strip = config.light_strips[int(strand)]
 
         ids = request.args.get('ids', "")
@@ -114,20 +227,28 @@ def add_animation_view():
             msg = "Animation {} on strip {} for {} lights: ".format(animation, strand, len(id_list), animation_text)
             start_new_animation(msg)
 
+            # Runs inside the animation engine, taking over these LEDs from any animation already on them
             animation_data = merge_dictionaries(
-                animation_data, {'strip': light_strip, 'strip_id': strand, 'id_list': id_list,
-                                 'command': animation_text, 'command_parsed': animation_data})
-
-            functions.start_process(functions.func_animation, msg, animation_data)
+                animation_data, {'strip': light_strip, 'strip_id': int(strand), 'id_list': id_list,
+                                 'animation': animation, 'command': animation_text, 'command_parsed': animation_data})
+            result = functions.add_animation(animation_data)
+            msg += "{}, id {}".format(result.get('message'), result.get('animation_id'))
         else:
             msg = "Animation {} requested but no lights given".format(animation)
 
     else:
         msg = "Animation {} on {} strips total, options: {}".format(animation, len(config.light_strips), animation_text)
         start_new_animation(msg)
-        for light_strip in config.light_strips:
-            functions.start_process(functions.func_animation, msg, {'strip': light_strip})
+        for strip_id, light_strip in enumerate(config.light_strips):
+            strip_animation_data = merge_dictionaries(
+                animation_data, {'strip': light_strip, 'strip_id': strip_id,
+                                 'id_list': list(range(light_strip.numPixels())), 'animation': animation,
+                                 'command': animation_text, 'command_parsed': animation_data})
+            result = functions.add_animation(strip_animation_data)
+            msg += ". Strip {}: {}, id {}".format(strip_id, result.get('message'), result.get('animation_id'))
 
+    for error in animation_data.get('errors', []):
+        msg += ". Position {}: {} '{}'".format(error['position'], error['message'], error['text'])
     return msg
 
 
@@ -219,13 +340,53 @@ def get_state():
         'mqtt_status': get_mqtt_status(),
         'animations_running': processes,
         'strands': get_strands_as_json(),
+        'power': supply_info([strip.power for strip in config.light_strips if strip.power]),
         'mode': config.current_mode,
-        'modes': config.animation_modes
+        'modes': config.animation_modes,
+        'mode_switch': functions.last_mode_switch,
+        'startup': config.startup
     }
 
     return json.dumps(state_obj)
 
 
+@app.route('/metrics')
+def get_metrics():
+    # Prometheus text format: per-animation next() times, fps and missed deadlines, per-strand show() times
+    return Response(functions.get_metrics_text(dict(commands_in_flight)),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/profile')
+def profile_view():
+    # Profile the running animation engines, eg /profile?seconds=10&mode=stacks or /profile?sort=time
+    # and return the sorted stats (mode=stats) or collapsed stacks for flame graphs (mode=stacks)
+    seconds = profile_seconds(request.args.get('seconds', DEFAULT_PROFILE_SECONDS))
+    if seconds is None:
+        return Response("Invalid seconds '{}', expected a number up to {}".format(
+            request.args.get('seconds'), MAX_PROFILE_SECONDS), status=400, mimetype='text/plain')
+    mode = request.args.get('mode', 'stats')
+    results = functions.profile_engines(seconds, mode, request.args.get('sort', 'cumulative'))
+    if not results:
+        return 'No animation engine is running'
+
+    output = ''
+    deadline = time.monotonic() + seconds + PROFILE_WRITE_TIMEOUT
+    for result in results:
+        output += '# Worker {}: {}\n'.format(result.get('worker'), result.get('message'))
+        if not result.get('ok'):
+            continue
+        path = result['paths'][0]
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if os.path.exists(path):
+            with open(path) as profile_file:
+                output += '# {}\n{}\n'.format(path, profile_file.read())
+        else:
+            output += '# {} was not written in time\n'.format(path)
+    return Response(output, mimetype='text/plain')
+
+
 @app.route('/colors_as_html')
 def get_colors():
     output = "<br/>"
@@ -233,10 +394,9 @@ def get_colors():
     for strip in config.light_strips:
         strip_num += 1
         strip_html = ""
+        pixels = strip.snapshot()  # Colors currently shown, even if another process is animating them
         for led in range(strip.numPixels()):
-            pixel = strip.getPixelColorRGB(led)
-            color = Colour(rgb=(pixel.r / 255.0, pixel.g / 255.0, pixel.b / 255.0))
-            hex_color = color.hex
+            hex_color = "#{:06x}".format(int(pixels[led]) & 0xffffff)
             strip_html += "<span style='color:{}' title='Strip {}, LED {}'>⬤</span>".format(hex_color, strip_num, led)
             if led % 40 == 39:
                 strip_html += " "  # Add a space every 40 lights
@@ -250,13 +410,13 @@ def get_strands_as_json():
     for strand_name in config.settings['strands']:
         strand_info = config.settings['strands'][strand_name]
         strip = config.light_strips[strip_num]
-        info = {'strand_name': strand_name, 'strand_info': strand_info}
+        info = {'strand_name': strand_name, 'strand_info': strand_info, 'show_counts': strip.show_counts(),
+                'power': strip.power_info()}
         led_info = []
 
+        pixels = strip.snapshot()  # Colors currently shown, even if another process is animating them
         for led in range(strip.numPixels()):
-            pixel = strip.getPixelColorRGB(led)
-            color = Colour(rgb=(pixel.r / 255.0, pixel.g / 255.0, pixel.b / 255.0))
-            hex_color = color.hex
+            hex_color = "#{:06x}".format(int(pixels[led]) & 0xffffff)
             led_database_info = config.light_data[strip_num][led]
             led_group_name = led_database_info['name'] if 'name' in led_database_info else '<not set>'
             animation_text = led_database_info['anim_text'] if 'anim_text' in led_database_info else '<not set>'
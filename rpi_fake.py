@@ -3,6 +3,7 @@
 """
 Methods to call light effect functions - but stubbed out so that all functions work on a macintosh
 """
+import numpy as np
 from includes import RGBW, Color
 
 
@@ -18,13 +19,11 @@ class PixelStrip:
         self.num = num
         self.pin = pin
         self.brightness = brightness
-        self.leds = []
-        for i in range(num):
-            self.leds.append(Color(0, 0, 0))
-        print("Added a string with leds: {}".format(self.leds))
+        self.leds = np.zeros(num, dtype=np.uint32)
+        print("Added a string with {} leds".format(num))
 
     def __getitem__(self, pos):
-        return self.leds[pos]
+        return RGBW(int(self.leds[pos]))
 
     def __setitem__(self, pos, value):
         self.leds[pos] = value
@@ -52,6 +51,10 @@ class PixelStrip:
         color = Color(red, green, blue)
         self.leds[n] = color
 
+    def setPixels(self, pixels):
+        # Bulk copy of a whole frame, used by FrameBuffer
+        self.leds[:] = pixels
+
     def getBrightness(self):
         return self.brightness
 
@@ -66,13 +69,13 @@ class PixelStrip:
         return self.num
 
     def getPixelColor(self, n):
-        return self.leds[n]
+        return RGBW(int(self.leds[n]))
 
     def getPixelColorRGB(self, n):
-        return RGBW(self.leds[n])
+        return RGBW(int(self.leds[n]))
 
     def getPixelColorRGBW(self, n):
-        return RGBW(self.leds[n])
+        return RGBW(int(self.leds[n]))
 
 
 # Shim for back-compatibility